@@ -1,6 +1,6 @@
 import asyncio
 from firebox import Sandbox
-from firebox.models import SandboxStatus, FilesystemOperation
+from firebox.models import FilesystemOperation
 
 
 async def main():
@@ -8,8 +8,7 @@ async def main():
     sandbox = Sandbox(template="firebox-sandbox")  # Use default template
 
     # Wait for the sandbox to be fully initialized
-    while sandbox.status != SandboxStatus.RUNNING:
-        await asyncio.sleep(0.1)
+    await sandbox.wait_until_open()
 
     print("Sandbox is ready!")
 
@@ -20,7 +20,8 @@ async def main():
     )
 
     try:
-        sandbox = await Sandbox(template=config)
+        sandbox = Sandbox(template=config)
+        await sandbox.wait_until_open()
         print("Sandbox created successfully")
 
         # Update package list
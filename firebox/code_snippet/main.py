@@ -1,15 +1,23 @@
 import asyncio
-from typing import Any, Callable, ClassVar, List, Optional
+from typing import Any, Callable, ClassVar, List, Optional, Tuple
 import json
 
 from firebox.models import OpenPort, CodeSnippet
 from firebox.exception import SandboxException
 from firebox.constants import TIMEOUT
 from firebox.logs import logger
-
+from firebox.utils.ports import SCAN_PORTS_CMD, parse_listening_ports
 
 ScanOpenedPortsHandler = Callable[[List[OpenPort]], Any]
 
+# Each script is printed as its name, NUL, its size in bytes, NUL and then its
+# content, so the content can hold any byte, NUL included
+_LIST_SCRIPTS_CMD = (
+    "cd /root/commands && for f in *; do "
+    '[ -f "$f" ] || continue; printf \'%s\\0%s\\0\' "$f" "$(stat -c %s "$f")"; '
+    'cat "$f"; done'
+)
+
 
 class CodeSnippetManager:
     def __init__(
@@ -19,6 +27,7 @@ class CodeSnippetManager:
     ):
         self.sandbox = sandbox
         self.on_scan_ports = on_scan_ports
+        self._port_scanner: Optional[asyncio.Task] = None
 
     async def subscribe(self):
         if self.on_scan_ports:
@@ -27,6 +36,14 @@ class CodeSnippetManager:
             except Exception as e:
                 raise SandboxException("Failed to subscribe to port scanning") from e
 
+    def unsubscribe(self):
+        """
+        Stop port scanning, if it is running.
+        """
+        if self._port_scanner:
+            self._port_scanner.cancel()
+            self._port_scanner = None
+
     async def _subscribe_to_port_scanning(self):
         async def port_scanner():
             while True:
@@ -35,26 +52,24 @@ class CodeSnippetManager:
                     self.on_scan_ports(ports)
                 await asyncio.sleep(10)  # Scan every 10 seconds
 
-        asyncio.create_task(port_scanner())
+        # Keep a reference so the task isn't garbage collected mid-flight, and
+        # report a crash from a done callback rather than a supervising task
+        self._port_scanner = asyncio.create_task(port_scanner())
+        self._port_scanner.add_done_callback(self._on_port_scanner_done)
+
+    @staticmethod
+    def _on_port_scanner_done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception():
+            logger.error("Port scanner stopped", exc_info=task.exception())
 
     async def _scan_ports(self) -> List[OpenPort]:
         try:
-            exit_code, output = await self.sandbox.communicate(
-                "netstat -tuln | grep LISTEN", timeout=TIMEOUT
-            )
-            if exit_code != 0:
-                raise Exception(f"Failed to scan ports: {output}")
-
-            ports = []
-            for line in output.split("\n"):
-                if line.strip():
-                    parts = line.split()
-                    if len(parts) >= 4:
-                        ip, port = parts[3].rsplit(":", 1)
-                        ports.append(OpenPort(ip=ip, port=int(port), state="LISTEN"))
-            return ports
+            # The exit code isn't checked: it is 1 when only tcp6 is missing,
+            # and the tcp table printed before that still counts
+            _, output = await self.sandbox.communicate(SCAN_PORTS_CMD, timeout=TIMEOUT)
+            return parse_listening_ports(output)
         except Exception as e:
-            logger.error(f"Failed to scan ports: {str(e)}")
+            logger.error("Failed to scan ports: %s", e)
             return []
 
     async def add_script(
@@ -68,18 +83,36 @@ class CodeSnippetManager:
         :param timeout: Timeout for the operation
         """
         try:
-            script_path = f"/root/commands/{name}"
-            escaped_content = content.replace('"', '\\"')
-            exit_code, output = await self.sandbox.communicate(
-                f'echo "{escaped_content}" > {script_path} && chmod +x {script_path}',
-                timeout=timeout,
+            # Uploaded as an archive, so the content never passes through a shell
+            await self.sandbox.put_files(
+                {f"/root/commands/{name}": content.encode("utf-8")}, mode=0o755
             )
-            if exit_code != 0:
-                raise Exception(f"Failed to add script: {output}")
             logger.info(f"Added script: {name}")
         except Exception as e:
             raise SandboxException(f"Failed to add script {name}: {str(e)}") from e
 
+    async def add_scripts(
+        self, scripts: List[Tuple[str, str]], timeout: Optional[float] = TIMEOUT
+    ) -> None:
+        """
+        Add several custom scripts to the sandbox in one upload.
+
+        :param scripts: (name, content) of each script
+        :param timeout: Timeout for the operation
+        """
+        names = [name for name, _ in scripts]
+        try:
+            await self.sandbox.put_files(
+                {
+                    f"/root/commands/{name}": content.encode("utf-8")
+                    for name, content in scripts
+                },
+                mode=0o755,
+            )
+            logger.info("Added scripts: %s", names)
+        except Exception as e:
+            raise SandboxException(f"Failed to add scripts {names}: {str(e)}") from e
+
     async def remove_script(
         self, name: str, timeout: Optional[float] = TIMEOUT
     ) -> None:
@@ -92,7 +125,7 @@ class CodeSnippetManager:
         try:
             script_path = f"/root/commands/{name}"
             exit_code, output = await self.sandbox.communicate(
-                f"rm -f {script_path}", timeout=timeout
+                ["rm", "-f", script_path], timeout=timeout
             )
             if exit_code != 0:
                 raise Exception(f"Failed to remove script: {output}")
@@ -111,16 +144,26 @@ class CodeSnippetManager:
         """
         try:
             exit_code, output = await self.sandbox.communicate(
-                "ls -1 /root/commands", timeout=timeout
+                _LIST_SCRIPTS_CMD, timeout=timeout, binary=True
             )
             if exit_code != 0:
-                raise Exception(f"Failed to list scripts: {output}")
+                raise Exception(
+                    f"Failed to list scripts: {output.decode('utf-8', 'replace')}"
+                )
 
             scripts = []
-            for name in output.split("\n"):
-                if name.strip():
-                    content = await self.get_script_content(name, timeout)
-                    scripts.append(CodeSnippet(name=name, content=content))
+            offset = 0
+            while offset < len(output):
+                name_end = output.index(b"\0", offset)
+                size_end = output.index(b"\0", name_end + 1)
+                content_end = size_end + 1 + int(output[name_end + 1 : size_end])
+                scripts.append(
+                    CodeSnippet(
+                        name=output[offset:name_end].decode("utf-8"),
+                        content=output[size_end + 1 : content_end].decode("utf-8"),
+                    )
+                )
+                offset = content_end
             return scripts
         except Exception as e:
             raise SandboxException(f"Failed to list scripts: {str(e)}") from e
@@ -152,9 +195,12 @@ class CodeSnippetManager:
         :return: Content of the script
         """
         script_path = f"/root/commands/{name}"
+        # Read as bytes, so the content isn't stripped like text output is
         exit_code, output = await self.sandbox.communicate(
-            f"cat {script_path}", timeout=timeout
+            ["cat", script_path], timeout=timeout, binary=True
         )
         if exit_code != 0:
-            raise Exception(f"Failed to read script content: {output}")
-        return output
+            raise Exception(
+                f"Failed to read script content: {output.decode('utf-8', 'replace')}"
+            )
+        return output.decode("utf-8")
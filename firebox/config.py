@@ -1,12 +1,12 @@
 import os
-from firebox.models import FireboxConfig
+from firebox.models import FireboxConfig, get_config
 
 
 def load_config(config_file: str = "firebox_config.yaml") -> FireboxConfig:
     if os.path.exists(config_file):
         return FireboxConfig.from_yaml(config_file)
     else:
-        return FireboxConfig()
+        return get_config()
 
 
 # Load configuration
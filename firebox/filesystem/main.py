@@ -1,13 +1,80 @@
-import base64
-from typing import List, Optional
+import aiofiles
+import binascii
+import posixpath
+import re
+import shlex
+from typing import AsyncIterator, Iterator, List, Optional, Set, Tuple, Union
 
 from firebox.constants import TIMEOUT
 from firebox.exception import FilesystemException
 from firebox.utils.filesystem import resolve_path
 from firebox.filesystem.watcher import Watcher
-from firebox.models import FileInfo
+from firebox.models import FileContentStatus, FileInfo, FileInfoWithContent
 from firebox.logs import logger
 
+# Text containing control characters is routed through `write_bytes` so the
+# shell never sees it raw.
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# Commands that take the path as their last argument; run as argv, without a
+# shell to parse and quote for.
+_CMD_READ = ("cat",)
+_CMD_READ_BASE64 = ("base64", "-w0")
+_CMD_REMOVE = ("rm", "-rf")
+_CMD_MAKE_DIR = ("mkdir", "-p")
+_CMD_EXISTS = ("test", "-e")
+_CMD_IS_FILE = ("test", "-f")
+_CMD_IS_DIR = ("test", "-d")
+_CMD_GET_SIZE = ("stat", "-c%s")
+_CMD_GET_TREE_SIZE = ("du", "-sb")
+
+# Shell command templates; paths and content are always shlex-quoted.
+_CMD_READ_BASE64_RANGE = (
+    "dd if={path} bs=64K iflag=skip_bytes,count_bytes skip={offset} count={length}"
+    " status=none | base64 -w0"
+)
+_CMD_WRITE = "printf '%s' {content} > {path}"
+# One "<type>\t<name>\0" record per entry; hidden entries are skipped like `ls`.
+_CMD_LIST = "find {path} -mindepth 1 -maxdepth 1 ! -name '.*' -printf '%y\\t%f\\0'"
+# "<type>\t<status><base64 if inlined>\t<name>\0" per entry; regular files
+# of at most `inline_max` bytes get "+" and their content, or "!" when they
+# can't be read, everything else gets "-"
+_CMD_LIST_WITH_CONTENTS = (
+    "find {path} -mindepth 1 -maxdepth 1 ! -name '.*' -printf '%y\\t'"
+    " \\( -type f -size -{inline_limit}c \\( -exec sh -c"
+    ' \'c=$(base64 -w0 "$1" 2>/dev/null) && printf "+%s" "$c"\' sh {{}} \\;'
+    " -o -printf '!' \\) -o -printf '-' \\)"
+    " -printf '\\t%f\\0'"
+)
+# Status prefix printed by _CMD_LIST_WITH_CONTENTS -> status reported
+_CONTENT_STATUSES = {
+    "+": FileContentStatus.Inlined,
+    "-": FileContentStatus.Skipped,
+    "!": FileContentStatus.Unreadable,
+}
+
+# Base64 payloads are decoded in slices of this many characters so large files
+# never need a second full-size copy. Must be a multiple of 4.
+_BASE64_CHUNK_SIZE = 1024 * 1024
+
+
+def _decode_base64(data: Union[str, bytes, memoryview]) -> bytes:
+    # The payload comes from the sandbox's own `base64` tool, so skip the
+    # b64decode wrapper: binascii reads ASCII str buffers in place instead of
+    # encoding them to a bytes copy first.
+    return binascii.a2b_base64(data)
+
+
+def _decode_base64_chunks(data: bytes) -> Iterator[bytes]:
+    # Sliced through a memoryview so no chunk of the payload is copied
+    with memoryview(data) as view:
+        for start in range(0, len(data), _BASE64_CHUNK_SIZE):
+            yield _decode_base64(view[start : start + _BASE64_CHUNK_SIZE])
+
+
+def _decoded_base64_size(data: bytes) -> int:
+    return len(data) // 4 * 3 - data[-2:].count(b"=")
+
 
 class FilesystemManager:
     """
@@ -16,11 +83,42 @@ class FilesystemManager:
 
     def __init__(self, sandbox):
         self._sandbox = sandbox
+        # Directories this manager has created (or seen created) during the
+        # session, so repeated make_dir calls can skip the round trip.
+        # Changes made behind the manager's back, e.g. by a process, are not
+        # tracked.
+        self._known_dirs: Set[str] = set()
 
     @property
     def cwd(self) -> Optional[str]:
         return self._sandbox.cwd
 
+    def _remember_dir(self, path: str) -> None:
+        path = posixpath.normpath(path)
+        while path not in self._known_dirs:
+            self._known_dirs.add(path)
+            path = posixpath.dirname(path)
+
+    def _forget_path(self, path: str) -> None:
+        path = posixpath.normpath(path)
+        prefix = path.rstrip("/") + "/"
+        self._known_dirs = {
+            d for d in self._known_dirs if d != path and not d.startswith(prefix)
+        }
+
+    async def _read_base64(self, path: str, timeout: Optional[float]) -> bytes:
+        # Kept as bytes: the payload is only ever base64-decoded
+        exit_code, output = await self._sandbox.communicate(
+            [*_CMD_READ_BASE64, path],
+            timeout=timeout,
+            binary=True,
+        )
+        if exit_code != 0:
+            raise Exception(
+                f"Failed to read file: {output.decode('utf-8', 'replace').strip()}"
+            )
+        return output
+
     async def read_bytes(self, path: str, timeout: Optional[float] = TIMEOUT) -> bytes:
         """
         Read the whole content of a file as a byte array.
@@ -32,17 +130,104 @@ class FilesystemManager:
         """
         path = resolve_path(path, self.cwd)
         try:
-            exit_code, output = await self._sandbox.communicate(
-                f"base64 {path}", timeout=timeout
-            )
-            if exit_code != 0:
-                raise Exception(f"Failed to read file: {output}")
-            return base64.b64decode(output)
+            return _decode_base64(await self._read_base64(path, timeout))
+        except Exception as e:
+            raise FilesystemException(
+                f"Failed to read bytes from {path}: {str(e)}"
+            ) from e
+
+    async def read_bytes_into(
+        self, path: str, buffer: bytearray, timeout: Optional[float] = TIMEOUT
+    ) -> int:
+        """
+        Read the whole content of a file into a caller-supplied buffer.
+        The buffer is grown if it is too small; it is never shrunk, so it can be
+        reused across reads.
+
+        :param path: path to a file
+        :param buffer: buffer the content is written to, starting at offset 0
+        :param timeout: timeout for the call
+        :return: number of bytes written to the buffer
+        """
+        path = resolve_path(path, self.cwd)
+        try:
+            data = await self._read_base64(path, timeout)
+            size = _decoded_base64_size(data)
+            if len(buffer) < size:
+                buffer.extend(bytes(size - len(buffer)))
+
+            offset = 0
+            with memoryview(buffer) as view:
+                for chunk in _decode_base64_chunks(data):
+                    view[offset : offset + len(chunk)] = chunk
+                    offset += len(chunk)
+            return offset
         except Exception as e:
             raise FilesystemException(
                 f"Failed to read bytes from {path}: {str(e)}"
             ) from e
 
+    async def read_bytes_stream(
+        self,
+        path: str,
+        chunk_size: int = 1024 * 1024,
+        timeout: Optional[float] = TIMEOUT,
+    ) -> AsyncIterator[bytes]:
+        """
+        Read a file as a stream of byte chunks.
+        Each chunk is fetched with a separate range read, so memory use is
+        bounded by the chunk size regardless of the file size.
+
+        :param path: path to a file
+        :param chunk_size: maximum size of each chunk in bytes
+        :param timeout: timeout for each call
+        :return: async iterator over the content of a file
+        """
+        size = await self.get_size(path, timeout=timeout)
+        path = resolve_path(path, self.cwd)
+        quoted_path = shlex.quote(path)
+        for offset in range(0, size, chunk_size):
+            try:
+                exit_code, output = await self._sandbox.communicate(
+                    _CMD_READ_BASE64_RANGE.format(
+                        path=quoted_path, offset=offset, length=chunk_size
+                    ),
+                    timeout=timeout,
+                    binary=True,
+                )
+                if exit_code != 0:
+                    raise Exception(
+                        f"Failed to read file: {output.decode('utf-8', 'replace').strip()}"
+                    )
+                chunk = _decode_base64(output)
+            except Exception as e:
+                raise FilesystemException(
+                    f"Failed to read bytes from {path} at offset {offset}: {str(e)}"
+                ) from e
+            yield chunk
+
+    async def download_file(
+        self, path: str, local_path: str, timeout: Optional[float] = TIMEOUT
+    ) -> None:
+        """
+        Download a file from the sandbox to the local filesystem.
+        The file is read with `read_bytes_stream` and each chunk is written as
+        it arrives, so memory use is bounded by the chunk size.
+
+        :param path: path to a file in the sandbox
+        :param local_path: path the file is written to on the local machine
+        :param timeout: timeout for each call
+        """
+        path = resolve_path(path, self.cwd)
+        try:
+            async with aiofiles.open(local_path, "wb") as local_file:
+                async for chunk in self.read_bytes_stream(path, timeout=timeout):
+                    await local_file.write(chunk)
+        except Exception as e:
+            raise FilesystemException(
+                f"Failed to download {path} to {local_path}: {str(e)}"
+            ) from e
+
     async def write_bytes(
         self, path: str, content: bytes, timeout: Optional[float] = TIMEOUT
     ) -> None:
@@ -50,25 +235,80 @@ class FilesystemManager:
         Write content to a file as a byte array.
         This can be used when you cannot represent the data as an UTF-8 string.
 
-        A new file will be created if it doesn't exist.
-        If the file already exists, it will be overwritten.
+        A new file will be created if it doesn't exist, along with its parent
+        directories. If the file already exists, it will be overwritten.
+        The content is sent as an archive upload rather than on a command line,
+        so its size is not limited by one.
 
         :param path: path to a file
         :param content: byte array representing the content to write
         :param timeout: timeout for the call
         """
         path = resolve_path(path, self.cwd)
-        base64_content = base64.b64encode(content).decode("utf-8")
         try:
-            exit_code, output = await self._sandbox.communicate(
-                f"echo '{base64_content}' | base64 -d > {path}", timeout=timeout
-            )
-            if exit_code != 0:
-                raise Exception(f"Failed to write file: {output}")
+            await self._sandbox.put_files({path: content})
         except Exception as e:
             raise FilesystemException(
                 f"Failed to write bytes to {path}: {str(e)}"
             ) from e
+        self._remember_dir(posixpath.dirname(path) or "/")
+
+    async def upload_file(
+        self, local_path: str, path: str, timeout: Optional[float] = TIMEOUT
+    ) -> None:
+        """
+        Upload a file from the local filesystem to the sandbox.
+
+        A new file will be created if it doesn't exist.
+        If the file already exists, it will be overwritten.
+
+        :param local_path: path to a file on the local machine
+        :param path: path the file is written to in the sandbox
+        :param timeout: timeout for the call
+        """
+        try:
+            async with aiofiles.open(local_path, "rb") as local_file:
+                content = await local_file.read()
+        except OSError as e:
+            raise FilesystemException(
+                f"Failed to read local file {local_path}: {str(e)}"
+            ) from e
+        await self.write_bytes(path, content, timeout=timeout)
+
+    async def upload_many_executables(
+        self, items: List[Tuple[str, str]], timeout: Optional[float] = TIMEOUT
+    ) -> None:
+        """
+        Upload several local files to the sandbox and mark them executable.
+        Parent directories are created as needed. The files are sent as one
+        archive upload, so the cost is one round trip regardless of the number
+        of files, and their size is not limited by a command line.
+
+        :param items: (local path, sandbox path) pairs
+        :param timeout: timeout for the call
+        """
+        if not items:
+            return
+
+        files = {}
+        for local_path, path in items:
+            try:
+                async with aiofiles.open(local_path, "rb") as local_file:
+                    content = await local_file.read()
+            except OSError as e:
+                raise FilesystemException(
+                    f"Failed to read local file {local_path}: {str(e)}"
+                ) from e
+            files[resolve_path(path, self.cwd)] = content
+
+        try:
+            await self._sandbox.put_files(files, mode=0o755)
+        except Exception as e:
+            raise FilesystemException(
+                f"Failed to upload {', '.join(files)}: {str(e)}"
+            ) from e
+        for path in files:
+            self._remember_dir(posixpath.dirname(path) or "/")
 
     async def read(self, path: str, timeout: Optional[float] = TIMEOUT) -> str:
         """
@@ -78,15 +318,15 @@ class FilesystemManager:
         :param timeout: Timeout for the operation
         :return: Content of a file
         """
-        logger.debug(f"Reading file {path}")
+        logger.debug("Reading file %s", path)
         path = resolve_path(path, self.cwd)
         try:
             exit_code, output = await self._sandbox.communicate(
-                f"cat {path}", timeout=timeout
+                [*_CMD_READ, path], timeout=timeout
             )
             if exit_code != 0:
                 raise Exception(f"Failed to read file: {output}")
-            logger.debug(f"Read file {path}")
+            logger.debug("Read file %s", path)
             return output
         except Exception as e:
             raise FilesystemException(f"Failed to read file {path}: {str(e)}") from e
@@ -100,19 +340,26 @@ class FilesystemManager:
         A new file will be created if it doesn't exist.
         If the file already exists, it will be overwritten.
 
+        Plain text is sent as-is; content with control characters falls back
+        to the archive upload used by `write_bytes`.
+
         :param path: Path to a file
         :param content: Content to write
         :param timeout: Timeout for the operation
         """
-        logger.debug(f"Writing file {path}")
+        if _CONTROL_CHARS.search(content):
+            return await self.write_bytes(path, content.encode("utf-8"), timeout)
+
+        logger.debug("Writing file %s", path)
         path = resolve_path(path, self.cwd)
         try:
             exit_code, output = await self._sandbox.communicate(
-                f"echo '{content}' > {path}", timeout=timeout
+                _CMD_WRITE.format(content=shlex.quote(content), path=shlex.quote(path)),
+                timeout=timeout,
             )
             if exit_code != 0:
                 raise Exception(f"Failed to write file: {output}")
-            logger.debug(f"Wrote file {path}")
+            logger.debug("Wrote file %s", path)
         except Exception as e:
             raise FilesystemException(
                 f"Failed to write to file {path}: {str(e)}"
@@ -125,15 +372,16 @@ class FilesystemManager:
         :param path: Path to a file or a directory
         :param timeout: Timeout for the operation
         """
-        logger.debug(f"Removing file {path}")
+        logger.debug("Removing file %s", path)
         path = resolve_path(path, self.cwd)
         try:
             exit_code, output = await self._sandbox.communicate(
-                f"rm -rf {path}", timeout=timeout
+                [*_CMD_REMOVE, path], timeout=timeout
             )
             if exit_code != 0:
                 raise Exception(f"Failed to remove file: {output}")
-            logger.debug(f"Removed file {path}")
+            self._forget_path(path)
+            logger.debug("Removed file %s", path)
         except Exception as e:
             raise FilesystemException(f"Failed to remove {path}: {str(e)}") from e
 
@@ -147,49 +395,123 @@ class FilesystemManager:
         :param timeout: Timeout for the operation
         :return: Array of FileInfo objects representing files in a directory
         """
-        logger.debug(f"Listing files in {path}")
+        logger.debug("Listing files in %s", path)
         path = resolve_path(path, self.cwd)
         try:
             exit_code, output = await self._sandbox.communicate(
-                f"ls -l {path}", timeout=timeout
+                _CMD_LIST.format(path=shlex.quote(path)), timeout=timeout
             )
             if exit_code != 0:
                 raise Exception(f"Failed to list directory: {output}")
-            logger.debug(f"Listed files in {path}, result: {output}")
+            logger.debug("Listed files in %s, result: %s", path, output)
+            # Rows are produced by find itself, so skip pydantic validation.
             files = []
-            for line in output.split("\n")[1:]:  # Skip the first line (total)
-                parts = line.split()
-                if len(parts) >= 9:
-                    is_dir = parts[0].startswith("d")
-                    name = " ".join(parts[8:])
-                    files.append(FileInfo(is_dir=is_dir, name=name))
+            append = files.append
+            for row in output.split("\0"):
+                if row:
+                    kind, name = row.split("\t", 1)
+                    append(FileInfo.model_construct(is_dir=kind == "d", name=name))
             return files
         except Exception as e:
             raise FilesystemException(
                 f"Failed to list directory {path}: {str(e)}"
             ) from e
 
+    async def list_with_contents(
+        self,
+        path: str,
+        inline_max: int = 64 * 1024,
+        timeout: Optional[float] = TIMEOUT,
+    ) -> List[FileInfoWithContent]:
+        """
+        List files in a directory together with the content of the small ones.
+        This replaces a `list` followed by one `read` per file with a single call.
+
+        :param path: Path to a directory
+        :param inline_max: Largest file size in bytes whose content is included
+        :param timeout: Timeout for the operation
+        :return: Entries of the directory; `status` tells whether the content was
+            inlined, skipped (directories and files larger than `inline_max`) or
+            could not be read, `content` is None unless it was inlined
+        """
+        logger.debug("Listing files with contents in %s", path)
+        path = resolve_path(path, self.cwd)
+        try:
+            exit_code, output = await self._sandbox.communicate(
+                _CMD_LIST_WITH_CONTENTS.format(
+                    path=shlex.quote(path), inline_limit=inline_max + 1
+                ),
+                timeout=timeout,
+            )
+            if exit_code != 0:
+                raise Exception(f"Failed to list directory: {output}")
+            entries = []
+            append = entries.append
+            for row in output.split("\0"):
+                if row:
+                    kind, content, name = row.split("\t", 2)
+                    status = _CONTENT_STATUSES[content[:1]]
+                    append(
+                        FileInfoWithContent.model_construct(
+                            is_dir=kind == "d",
+                            name=name,
+                            status=status,
+                            content=(
+                                _decode_base64(content[1:])
+                                if status is FileContentStatus.Inlined
+                                else None
+                            ),
+                        )
+                    )
+            return entries
+        except Exception as e:
+            raise FilesystemException(
+                f"Failed to list directory {path}: {str(e)}"
+            ) from e
+
     async def make_dir(self, path: str, timeout: Optional[float] = TIMEOUT) -> None:
         """
         Create a new directory and all directories along the way if needed on the specified path.
+        Directories already created through this manager are not created again.
 
         :param path: Path to a new directory
         :param timeout: Timeout for the operation
         """
-        logger.debug(f"Creating directory {path}")
         path = resolve_path(path, self.cwd)
+        if posixpath.normpath(path) in self._known_dirs:
+            return
+
+        logger.debug("Creating directory %s", path)
         try:
             exit_code, output = await self._sandbox.communicate(
-                f"mkdir -p {path}", timeout=timeout
+                [*_CMD_MAKE_DIR, path], timeout=timeout
             )
             if exit_code != 0:
                 raise Exception(f"Failed to create directory: {output}")
-            logger.debug(f"Created directory {path}")
+            self._remember_dir(path)
+            logger.debug("Created directory %s", path)
         except Exception as e:
             raise FilesystemException(
                 f"Failed to create directory {path}: {str(e)}"
             ) from e
 
+    async def _bool_probe(
+        self,
+        command: Tuple[str, ...],
+        path: str,
+        action: str,
+        timeout: Optional[float],
+    ) -> bool:
+        # `test` answers through its exit code alone, so no output needs to
+        # be produced or parsed.
+        try:
+            exit_code, _ = await self._sandbox.communicate(
+                [*command, path], timeout=timeout
+            )
+            return exit_code == 0
+        except Exception as e:
+            raise FilesystemException(f"Failed to {action}: {str(e)}") from e
+
     async def exists(self, path: str, timeout: Optional[float] = TIMEOUT) -> bool:
         """
         Check if a file or directory exists.
@@ -199,15 +521,9 @@ class FilesystemManager:
         :return: True if the path exists, False otherwise
         """
         path = resolve_path(path, self.cwd)
-        try:
-            exit_code, _ = await self._sandbox.communicate(
-                f"test -e {path}", timeout=timeout
-            )
-            return exit_code == 0
-        except Exception as e:
-            raise FilesystemException(
-                f"Failed to check existence of {path}: {str(e)}"
-            ) from e
+        return await self._bool_probe(
+            _CMD_EXISTS, path, f"check existence of {path}", timeout
+        )
 
     async def is_file(self, path: str, timeout: Optional[float] = TIMEOUT) -> bool:
         """
@@ -218,15 +534,9 @@ class FilesystemManager:
         :return: True if the path is a file, False otherwise
         """
         path = resolve_path(path, self.cwd)
-        try:
-            exit_code, _ = await self._sandbox.communicate(
-                f"test -f {path}", timeout=timeout
-            )
-            return exit_code == 0
-        except Exception as e:
-            raise FilesystemException(
-                f"Failed to check if {path} is a file: {str(e)}"
-            ) from e
+        return await self._bool_probe(
+            _CMD_IS_FILE, path, f"check if {path} is a file", timeout
+        )
 
     async def is_dir(self, path: str, timeout: Optional[float] = TIMEOUT) -> bool:
         """
@@ -237,19 +547,18 @@ class FilesystemManager:
         :return: True if the path is a directory, False otherwise
         """
         path = resolve_path(path, self.cwd)
-        try:
-            exit_code, _ = await self._sandbox.communicate(
-                f"test -d {path}", timeout=timeout
-            )
-            return exit_code == 0
-        except Exception as e:
-            raise FilesystemException(
-                f"Failed to check if {path} is a directory: {str(e)}"
-            ) from e
+        is_dir = await self._bool_probe(
+            _CMD_IS_DIR, path, f"check if {path} is a directory", timeout
+        )
+        if is_dir:
+            self._remember_dir(path)
+        return is_dir
 
     async def get_size(self, path: str, timeout: Optional[float] = TIMEOUT) -> int:
         """
-        Get the size of a file or directory.
+        Get the size of a file or directory entry.
+        This is a single stat call; directories are not walked, see
+        `get_tree_size` for the recursive total.
 
         :param path: Path to get size for
         :param timeout: Timeout for the operation
@@ -258,7 +567,7 @@ class FilesystemManager:
         path = resolve_path(path, self.cwd)
         try:
             exit_code, output = await self._sandbox.communicate(
-                f"stat -c%s {path}", timeout=timeout
+                [*_CMD_GET_SIZE, path], timeout=timeout
             )
             if exit_code != 0:
                 raise Exception(f"Failed to get size: {output}")
@@ -266,6 +575,28 @@ class FilesystemManager:
         except Exception as e:
             raise FilesystemException(f"Failed to get size of {path}: {str(e)}") from e
 
+    async def get_tree_size(self, path: str, timeout: Optional[float] = TIMEOUT) -> int:
+        """
+        Get the total size of a directory tree.
+        Unlike `get_size`, this walks every entry below the path.
+
+        :param path: Path to get size for
+        :param timeout: Timeout for the operation
+        :return: Size in bytes
+        """
+        path = resolve_path(path, self.cwd)
+        try:
+            exit_code, output = await self._sandbox.communicate(
+                [*_CMD_GET_TREE_SIZE, path], timeout=timeout
+            )
+            if exit_code != 0:
+                raise Exception(f"Failed to get tree size: {output}")
+            return int(output.split(None, 1)[0])
+        except Exception as e:
+            raise FilesystemException(
+                f"Failed to get tree size of {path}: {str(e)}"
+            ) from e
+
     def watch_dir(self, path: str) -> Watcher:
         """
         Watches directory for filesystem events.
@@ -273,7 +604,7 @@ class FilesystemManager:
         :param path: Path to a directory that will be watched
         :return: New watcher
         """
-        logger.debug(f"Watching directory {path}")
+        logger.debug("Watching directory %s", path)
         path = resolve_path(path, self.cwd)
         return Watcher(
             connection=self._sandbox,
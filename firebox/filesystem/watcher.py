@@ -1,10 +1,11 @@
 import asyncio
-from typing import Callable, Any, Optional, Set
+from typing import Awaitable, Callable, Any, Dict, Optional, Tuple
 
 from firebox.constants import TIMEOUT
 from firebox.exception import FilesystemException
 from firebox.models import FilesystemEvent, FilesystemOperation
 from firebox.logs import logger
+from firebox.utils.tasks import create_eager_task
 
 
 class Watcher:
@@ -21,14 +22,33 @@ class Watcher:
         self._connection = connection
         self._path = path
         self._service_name = service_name
-        self._unsubscribe: Optional[Callable[[], Any]] = None
-        self._listeners: Set[Callable[[FilesystemEvent], Any]] = set()
+        self._unsubscribe: Optional[Callable[[], Awaitable[None]]] = None
+        # Listeners in registration order, split by whether they are coroutine
+        # functions (checked once at registration). Sync listeners are called
+        # inline; coroutine listeners for an event are gathered together by a
+        # single long-lived task instead of getting a task each. Keyed by the
+        # listener itself, so adding an equal one again, e.g. the same bound
+        # method, keeps a single copy.
+        self._sync_listeners: Dict[Callable[[FilesystemEvent], Any], None] = {}
+        self._async_listeners: Dict[Callable[[FilesystemEvent], Any], None] = {}
+        # Tuples of the above, rebuilt only when listeners change, so dispatch
+        # iterates a fixed snapshot that listeners can safely mutate under it
+        self._sync_snapshot: Tuple[Callable[[FilesystemEvent], Any], ...] = ()
+        self._async_snapshot: Tuple[Callable[[FilesystemEvent], Any], ...] = ()
+        # Created by start(), inside the running loop
+        self._queue: Optional[asyncio.Queue] = None
+        self._dispatcher: Optional[asyncio.Task] = None
 
     async def start(self, timeout: Optional[float] = TIMEOUT) -> None:
         if self._unsubscribe:
             return
 
-        logger.debug(f"Starting filesystem watcher for {self.path}")
+        logger.debug("Starting filesystem watcher for %s", self.path)
+        if self._dispatcher is None:
+            self._queue = asyncio.Queue()
+            self._dispatcher = create_eager_task(
+                self._dispatch_async_listeners(self._queue)
+            )
         try:
             self._unsubscribe = await self._connection._subscribe(
                 self._service_name,
@@ -37,39 +57,78 @@ class Watcher:
                 self.path,
                 timeout=timeout,
             )
-            logger.debug(f"Started filesystem watcher for {self.path}")
+            logger.debug("Started filesystem watcher for %s", self.path)
         except Exception as e:
             raise FilesystemException(
                 f"Failed to start watcher for {self.path}: {str(e)}"
             ) from e
 
     async def stop(self) -> None:
-        logger.debug(f"Stopping filesystem watcher for {self.path}")
+        if not (
+            self._unsubscribe
+            or self._dispatcher
+            or self._sync_snapshot
+            or self._async_snapshot
+        ):
+            return
+
+        logger.debug("Stopping filesystem watcher for %s", self.path)
 
         if self._unsubscribe:
-            self._unsubscribe()
-            self._unsubscribe = None
-            logger.debug(f"Stopped filesystem watcher for {self.path}")
+            unsubscribe, self._unsubscribe = self._unsubscribe, None
+            await unsubscribe()
+            logger.debug("Stopped filesystem watcher for %s", self.path)
+
+        dispatcher, self._dispatcher = self._dispatcher, None
+        if dispatcher and not dispatcher.done():
+            # Drop undispatched events and let the dispatcher exit after the
+            # current one instead of cancelling it, which could cancel a
+            # listener that is itself awaiting stop()
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(None)
 
-        self._listeners.clear()
+        self._sync_listeners.clear()
+        self._async_listeners.clear()
+        self._refresh_snapshots()
 
     def add_event_listener(
         self, listener: Callable[[FilesystemEvent], Any]
     ) -> Callable[[], None]:
-        self._listeners.add(listener)
-        return lambda: self._listeners.remove(listener)
+        if asyncio.iscoroutinefunction(listener):
+            listeners = self._async_listeners
+        else:
+            listeners = self._sync_listeners
+        listeners[listener] = None
+        self._refresh_snapshots()
 
-    def _handle_filesystem_events(self, event: FilesystemEvent) -> None:
-        for listener in self._listeners:
-            asyncio.create_task(self._call_listener(listener, event))
+        def remove_listener() -> None:
+            if listener in listeners:
+                del listeners[listener]
+                self._refresh_snapshots()
 
-    async def _call_listener(
-        self, listener: Callable[[FilesystemEvent], Any], event: FilesystemEvent
-    ) -> None:
-        try:
-            if asyncio.iscoroutinefunction(listener):
-                await listener(event)
-            else:
+        return remove_listener
+
+    def _refresh_snapshots(self) -> None:
+        self._sync_snapshot = tuple(self._sync_listeners)
+        self._async_snapshot = tuple(self._async_listeners)
+
+    def _handle_filesystem_events(self, event: FilesystemEvent) -> None:
+        for listener in self._sync_snapshot:
+            try:
                 listener(event)
-        except Exception as e:
-            logger.error(f"Error in filesystem event listener: {str(e)}")
+            except Exception:
+                logger.exception("Error in filesystem event listener")
+
+        if self._async_snapshot and self._queue is not None:
+            self._queue.put_nowait((self._async_snapshot, event))
+
+    async def _dispatch_async_listeners(self, queue: asyncio.Queue) -> None:
+        while (item := await queue.get()) is not None:
+            listeners, event = item
+            results = await asyncio.gather(
+                *(listener(event) for listener in listeners), return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error("Error in filesystem event listener", exc_info=result)
@@ -1,6 +1,12 @@
 from .code_snippet import OpenPort, CodeSnippet
-from .config import FireboxConfig
-from .filesystem import FileInfo, FilesystemOperation, FilesystemEvent
+from .config import FireboxConfig, get_config, reset_config
+from .filesystem import (
+    FileContentStatus,
+    FileInfo,
+    FileInfoWithContent,
+    FilesystemOperation,
+    FilesystemEvent,
+)
 from .process import (
     EnvVars,
     ProcessEvent,
@@ -17,7 +23,11 @@ __all__ = [
     "OpenPort",
     "CodeSnippet",
     "FireboxConfig",
+    "get_config",
+    "reset_config",
+    "FileContentStatus",
     "FileInfo",
+    "FileInfoWithContent",
     "FilesystemOperation",
     "FilesystemEvent",
     "EnvVars",
@@ -1,5 +1,6 @@
+import functools
 import os
-import yaml
+from typing import Optional
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -8,6 +9,7 @@ class FireboxConfig(BaseSettings):
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
+        frozen=True,
     )
 
     sandbox_image: str = Field(
@@ -45,6 +47,11 @@ class FireboxConfig(BaseSettings):
         description="Docker host URL",
         json_schema_extra={"env": "FIREBOX_DOCKER_HOST"},
     )
+    docker_pool_size: int = Field(
+        default=16,
+        description="Threads for short blocking Docker calls, shared by all sandboxes",
+        json_schema_extra={"env": "FIREBOX_DOCKER_POOL_SIZE"},
+    )
     debug: bool = Field(
         default=False,
         description="Debug mode flag",
@@ -55,6 +62,12 @@ class FireboxConfig(BaseSettings):
         description="Logging level",
         json_schema_extra={"env": "FIREBOX_LOG_LEVEL"},
     )
+    process_output_max_lines: Optional[int] = Field(
+        default=None,
+        description="Most output lines kept per process, the oldest are dropped "
+        "first (unlimited if unset)",
+        json_schema_extra={"env": "FIREBOX_PROCESS_OUTPUT_MAX_LINES"},
+    )
     max_retries: int = Field(
         default=3,
         description="Maximum number of retries for operations",
@@ -68,6 +81,24 @@ class FireboxConfig(BaseSettings):
 
     @classmethod
     def from_yaml(cls, yaml_file: str) -> "FireboxConfig":
+        # yaml is only needed here, so keep it off the package import path
+        import yaml
+
         with open(yaml_file, "r") as f:
             config_dict = yaml.safe_load(f)
         return cls(**config_dict)
+
+
+@functools.lru_cache(maxsize=1)
+def get_config() -> FireboxConfig:
+    """
+    Return the settings read from the environment and ``.env``, parsed on first use only.
+    """
+    return FireboxConfig()
+
+
+def reset_config() -> None:
+    """
+    Drop the cached settings so the next get_config() reads the environment again.
+    """
+    get_config.cache_clear()
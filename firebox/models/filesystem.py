@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
 from enum import Enum
 from firebox.utils.str import snake_case_to_camel_case
 
@@ -8,6 +10,17 @@ class FileInfo(BaseModel):
     name: str
 
 
+class FileContentStatus(str, Enum):
+    Inlined = "Inlined"
+    Skipped = "Skipped"
+    Unreadable = "Unreadable"
+
+
+class FileInfoWithContent(FileInfo):
+    status: FileContentStatus
+    content: Optional[bytes] = None
+
+
 class FilesystemOperation(str, Enum):
     Create = "Create"
     Write = "Write"
@@ -23,5 +36,6 @@ class FilesystemEvent(BaseModel):
     timestamp: int
     is_dir: bool
 
-    class ConfigDict:
-        alias_generator = snake_case_to_camel_case
+    model_config = ConfigDict(
+        alias_generator=snake_case_to_camel_case, populate_by_name=True
+    )
@@ -1,6 +1,10 @@
-from pydantic import BaseModel, Field
+import bisect
+import sys
+from dataclasses import dataclass
+
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 from enum import Enum
-from typing import Dict, Optional, ClassVar, List
+from typing import Any, Dict, Optional, ClassVar, List
 from firebox.utils.str import snake_case_to_camel_case
 
 EnvVars = Dict[str, str]
@@ -23,8 +27,9 @@ class ProcessEvent(BaseModel):
     signal: Optional[int] = None
     data: Optional[str] = None  # For stdout/stderr events
 
-    class ConfigDict:
-        alias_generator = snake_case_to_camel_case
+    model_config = ConfigDict(
+        alias_generator=snake_case_to_camel_case, populate_by_name=True
+    )
 
     def __str__(self):
         if self.event_type == ProcessEventType.START:
@@ -45,34 +50,136 @@ class ProcessEvent(BaseModel):
             return f"Unknown event for process {self.pid} at {self.timestamp}"
 
 
-class ProcessMessage(BaseModel):
+# One is built per output line, so it is a plain (slotted where supported)
+# dataclass rather than a validated model
+@dataclass(**({"slots": True} if sys.version_info >= (3, 10) else {}))
+class ProcessMessage:
     line: str
-    error: bool = False
     timestamp: int
+    error: bool = False
 
     def __str__(self):
         return self.line
 
+    @classmethod
+    def model_validate(cls, data: Dict[str, Any]) -> "ProcessMessage":
+        return cls(**data)
+
+
+def _insort(timestamps: List[int], items: List[Any], timestamp: int, item: Any):
+    """
+    Insert item into items keeping it ordered by the parallel timestamps list.
+
+    Equal timestamps keep their arrival order.
+    """
+    if not timestamps or timestamp >= timestamps[-1]:
+        timestamps.append(timestamp)
+        items.append(item)
+        return
+
+    i = bisect.bisect_right(timestamps, timestamp)
+    timestamps.insert(i, timestamp)
+    items.insert(i, item)
+
 
 class ProcessOutput(BaseModel):
     delimiter: ClassVar[str] = "\n"
     messages: List[ProcessMessage] = []
     error: bool = False
     exit_code: Optional[int] = None
+    # Messages discarded from the start of ``messages`` to keep it under the
+    # line limit
+    dropped: int = 0
+    # At most this many lines are kept in ``messages`` and in each of
+    # stdout/stderr, the oldest are discarded first; None keeps everything
+    _max_lines: Optional[int] = PrivateAttr(default=None)
+    # Timestamps of ``messages`` in the same order, kept for bisecting
+    _timestamps: List[int] = PrivateAttr(default_factory=list)
+    # Lines of each stream in timestamp order, plus their joined form which is
+    # computed on first access and dropped whenever a line is added
+    _stdout_timestamps: List[int] = PrivateAttr(default_factory=list)
+    _stdout_parts: List[str] = PrivateAttr(default_factory=list)
+    _stdout: Optional[str] = PrivateAttr(default=None)
+    _stderr_timestamps: List[int] = PrivateAttr(default_factory=list)
+    _stderr_parts: List[str] = PrivateAttr(default_factory=list)
+    _stderr: Optional[str] = PrivateAttr(default=None)
 
     @property
     def stdout(self) -> str:
-        return self.delimiter.join(out.line for out in self.messages if not out.error)
+        if self._stdout is None:
+            self._stdout = self.delimiter.join(self._stdout_parts)
+        return self._stdout
 
     @property
     def stderr(self) -> str:
-        return self.delimiter.join(out.line for out in self.messages if out.error)
+        if self._stderr is None:
+            self._stderr = self.delimiter.join(self._stderr_parts)
+        return self._stderr
 
     def _insert_by_timestamp(self, message: ProcessMessage):
-        i = len(self.messages) - 1
-        while i >= 0 and self.messages[i].timestamp > message.timestamp:
-            i -= 1
-        self.messages.insert(i + 1, message)
+        timestamp = message.timestamp
+        _insort(self._timestamps, self.messages, timestamp, message)
+        if message.error:
+            _insort(
+                self._stderr_timestamps, self._stderr_parts, timestamp, message.line
+            )
+            self._stderr = None
+        else:
+            _insort(
+                self._stdout_timestamps, self._stdout_parts, timestamp, message.line
+            )
+            self._stdout = None
+        self._trim()
+
+    def _trim(self):
+        limit = self._max_lines
+        if limit is None:
+            return
+        excess = len(self.messages) - limit
+        if excess > 0:
+            del self.messages[:excess], self._timestamps[:excess]
+            self.dropped += excess
+        excess = len(self._stdout_parts) - limit
+        if excess > 0:
+            del self._stdout_parts[:excess], self._stdout_timestamps[:excess]
+            self._stdout = None
+        excess = len(self._stderr_parts) - limit
+        if excess > 0:
+            del self._stderr_parts[:excess], self._stderr_timestamps[:excess]
+            self._stderr = None
+
+    def _extend(self, messages: List[ProcessMessage]):
+        """
+        Add a batch of messages, appending in bulk when it is in order and not older
+        than anything already stored (the usual case for streamed output).
+        """
+        if not messages:
+            return
+        timestamps = [message.timestamp for message in messages]
+        if (self._timestamps and timestamps[0] < self._timestamps[-1]) or (
+            timestamps != sorted(timestamps)
+        ):
+            for message in messages:
+                if message.error:
+                    self._add_stderr(message)
+                else:
+                    self._add_stdout(message)
+            return
+
+        self._timestamps.extend(timestamps)
+        self.messages.extend(messages)
+        stdout = [message for message in messages if not message.error]
+        if stdout:
+            self._stdout_timestamps.extend(message.timestamp for message in stdout)
+            self._stdout_parts.extend(message.line for message in stdout)
+            self._stdout = None
+        if len(stdout) < len(messages):
+            stderr = [message for message in messages if message.error]
+            self._stderr_timestamps.extend(message.timestamp for message in stderr)
+            self._stderr_parts.extend(message.line for message in stderr)
+            self._stderr = None
+            self.error = True
+        self._trim()
 
     def _add_stdout(self, message: ProcessMessage):
         self._insert_by_timestamp(message)
@@ -83,6 +190,8 @@ class ProcessOutput(BaseModel):
 
 
 class ProcessConfig(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     cmd: str = Field(..., description="Command to execute")
     env_vars: Dict[str, str] = Field(
         default_factory=dict, description="Environment variables for the process"
@@ -1,9 +1,11 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Dict, Any, Optional
 from enum import Enum
 
 
 class DockerSandboxConfig(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     sandbox_id: Optional[str] = Field(
         default=None, description="Unique identifier for the sandbox"
     )
@@ -34,6 +36,11 @@ class DockerSandboxConfig(BaseModel):
     metadata: Optional[Dict[str, Any]] = Field(
         default_factory=dict, description="Optional metadata for the sandbox"
     )
+    persistent_shell: bool = Field(
+        default=False,
+        description="Run commands through one long-lived shell instead of a docker "
+        "exec each; commands are then serialized",
+    )
 
 
 class SandboxStatus(Enum):
@@ -44,6 +51,8 @@ class SandboxStatus(Enum):
 
 
 class SandboxInfo(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     sandbox_id: str = Field(..., description="Unique identifier of the sandbox")
     status: SandboxStatus
     metadata: Dict[str, Any] = Field(
@@ -1,8 +1,19 @@
-from pydantic import BaseModel
+from typing import List
+
+from pydantic import BaseModel, PrivateAttr, computed_field
 
 
 class TerminalOutput(BaseModel):
-    data: str = ""
+    # Chunks are collected and only joined when data is read, instead of
+    # concatenating the whole output string on every chunk
+    _chunks: List[str] = PrivateAttr(default_factory=list)
+
+    @computed_field
+    @property
+    def data(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks[:] = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
 
     def _add_data(self, data: str) -> None:
-        self.data += data
+        self._chunks.append(data)
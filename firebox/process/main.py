@@ -1,15 +1,44 @@
 import asyncio
-import time
-import shlex
-from typing import Dict, Optional, Any, List, Callable, Union
+import re
+import uuid
+from typing import Dict, Optional, Any, List, Callable, Tuple, Union
 
 from ..exception import ProcessException, TimeoutException
 from ..models.process import EnvVars, ProcessMessage, ProcessOutput, RunningProcess
+from ..config import config
 from ..constants import TIMEOUT
 from ..logs import logger
+from ..utils.clock import timestamp_ns
+from ..utils.signals import signal_by_env_cmd
+
+_PS_CMD = ["ps", "-eo", "pid,state,cmd", "--no-headers"]
+# One row of _PS_CMD's output
+_PS_LINE = re.compile(r"^\s*(\d+)\s+(\S+)\s+(.*?)\s*$", re.MULTILINE)
+
+# Set on every process's exec so that it and all its children can be found
+# through /proc/*/environ to be signalled
+_TOKEN_ENV_VAR = "FIREBOX_PROCESS_TOKEN"
+# Seconds a process gets to exit after SIGTERM before it is sent SIGKILL
+_KILL_GRACE_PERIOD = 5
 
 
 class Process:
+    __slots__ = (
+        "_process_id",
+        "_sandbox",
+        "_cmd",
+        "_env_vars",
+        "_cwd",
+        "_on_stdout",
+        "_on_stderr",
+        "_on_exit",
+        "_output",
+        "_finished",
+        "_task",
+        "_token",
+        "_stdin",
+    )
+
     def __init__(
         self,
         process_id: str,
@@ -20,6 +49,7 @@ class Process:
         on_stdout: Optional[Callable[[ProcessMessage], Any]] = None,
         on_stderr: Optional[Callable[[ProcessMessage], Any]] = None,
         on_exit: Optional[Union[Callable[[int], Any], Callable[[], Any]]] = None,
+        stdin: bool = False,
     ):
         self._process_id = process_id
         self._sandbox = sandbox
@@ -30,8 +60,12 @@ class Process:
         self._on_stderr = on_stderr
         self._on_exit = on_exit
         self._output = ProcessOutput()
+        self._output._max_lines = config.process_output_max_lines
         self._finished = asyncio.Future()
         self._task = None
+        self._token = uuid.uuid4().hex
+        # Resolved with the running command's stdin once its exec has started
+        self._stdin = asyncio.Future() if stdin else None
 
     @property
     def exit_code(self) -> Optional[int]:
@@ -69,72 +103,150 @@ class Process:
 
     async def start(self):
         self._task = asyncio.create_task(self._run())
+        # Also covers a task cancelled by kill() before _run got to execute
+        self._task.add_done_callback(self._mark_finished)
 
-    async def wait(self, timeout: Optional[float] = None) -> ProcessOutput:
+    def _mark_finished(self, _task: asyncio.Task) -> None:
+        if not self._finished.done():
+            self._finished.set_result(True)
+
+    async def _wait_finished(self, timeout: Optional[float]) -> bool:
+        """
+        Wait for the process to finish.
+
+        :param timeout: Seconds to wait, None to wait indefinitely
+        :return: Whether the process finished within the timeout
+        """
+        if self._finished.done():
+            return True
         try:
-            await asyncio.wait_for(self._finished, timeout=timeout)
-            return self._output
+            # Shielded so that timing out doesn't cancel the shared future and
+            # break later waits
+            await asyncio.wait_for(asyncio.shield(self._finished), timeout=timeout)
+            return True
         except asyncio.TimeoutError:
+            return False
+
+    async def wait(self, timeout: Optional[float] = None) -> ProcessOutput:
+        if not await self._wait_finished(timeout):
             raise TimeoutException(f"Process did not finish within {timeout} seconds")
+        return self._output
 
-    async def kill(self, timeout: Optional[float] = TIMEOUT) -> None:
-        if self._task:
-            self._task.cancel()
-            try:
-                await asyncio.wait_for(self._task, timeout=timeout)
-            except asyncio.TimeoutError:
-                logger.warning(
-                    f"Failed to cancel process {self._process_id} within timeout"
-                )
-            except asyncio.CancelledError:
-                pass
+    async def kill(
+        self,
+        timeout: Optional[float] = TIMEOUT,
+        graceful_timeout: float = _KILL_GRACE_PERIOD,
+    ) -> None:
+        """
+        Stop the process with SIGTERM, and SIGKILL if it is still running after
+        graceful_timeout.
+
+        :param timeout: Seconds to wait for the process to exit after SIGKILL
+        :param graceful_timeout: Seconds to wait for the process to exit after SIGTERM
+        """
+        if not self._finished.done():
+            await self._signal("TERM")
+            if not await self._wait_finished(graceful_timeout):
+                await self._signal("KILL")
+
+        if not await self._wait_finished(timeout):
+            logger.warning("Failed to kill process %s within timeout", self._process_id)
+            # At least stop following its output
+            if self._task:
+                self._task.cancel()
+                await self._wait_finished(None)
+
+    async def _signal(self, signal: str) -> None:
+        try:
+            await self._sandbox.communicate(
+                signal_by_env_cmd(_TOKEN_ENV_VAR, self._token, signal)
+            )
+        except Exception as e:
+            logger.warning(
+                "Failed to send SIG%s to process %s: %s", signal, self._process_id, e
+            )
 
     async def _run(self):
         try:
-            env_vars_str = " ".join(
-                f"export {k}={shlex.quote(v)};" for k, v in self._env_vars.items()
+            # env and cwd are set on the exec itself rather than through a
+            # nested shell
+            logger.debug("Executing command: %s", self._cmd)
+            exit_code = await self._sandbox.exec_streaming(
+                self._cmd,
+                self._handle_output,
+                environment={**self._env_vars, _TOKEN_ENV_VAR: self._token},
+                workdir=self._cwd,
+                on_stdin=self._stdin.set_result if self._stdin else None,
             )
-            full_cmd = f"bash -c {shlex.quote(f'{env_vars_str} cd {shlex.quote(self._cwd)} && {self._cmd}')}"
-
-            logger.debug(f"Executing command: {full_cmd}")
-            exit_code, output = await self._sandbox.communicate(full_cmd)
-
-            lines = output.splitlines()
-            timestamp = int(time.time() * 1e9)  # nanoseconds
-            for line in lines:
-                message = ProcessMessage(line=line, timestamp=timestamp, error=False)
-                self._output._add_stdout(message)
-                if self._on_stdout:
-                    self._on_stdout(message)
 
             self._output.exit_code = exit_code
             if self._on_exit:
                 self._on_exit(exit_code)
         except Exception as e:
-            logger.error(f"Error running process: {str(e)}")
+            logger.error("Error running process: %s", e)
             self._output.error = True
             if self._on_stderr:
                 self._on_stderr(
-                    ProcessMessage(
-                        line=str(e), timestamp=int(time.time() * 1e9), error=True
-                    )
+                    ProcessMessage(line=str(e), timestamp=timestamp_ns(), error=True)
                 )
         finally:
             if not self._finished.done():
                 self._finished.set_result(True)
 
+    def _handle_output(self, lines: List[Tuple[bool, str, int]]) -> None:
+        messages = [
+            ProcessMessage(line, timestamp, error) for error, line, timestamp in lines
+        ]
+        self._output._extend(messages)
+        if not (self._on_stdout or self._on_stderr):
+            return
+        for message in messages:
+            callback = self._on_stderr if message.error else self._on_stdout
+            if callback:
+                callback(message)
+
+    async def _get_stdin(self, timeout: Optional[float]):
+        if self._stdin is None:
+            raise ProcessException("Process was started without stdin")
+        # Until the exec has started there is no stdin to write to yet
+        await asyncio.wait(
+            (self._stdin, self._finished),
+            timeout=timeout,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if self._finished.done():
+            raise ProcessException("Process has finished")
+        if not self._stdin.done():
+            raise TimeoutException(f"Process did not start within {timeout} seconds")
+        return self._stdin.result()
+
     async def send_stdin(self, data: str, timeout: Optional[float] = TIMEOUT) -> None:
+        """
+        Write data to the stdin of the running process.
+
+        :param data: Data to write, as is
+        :param timeout: Seconds to wait for the write
+        """
+        stdin = await self._get_stdin(timeout)
         try:
-            cmd = f"echo '{data}' | {self._cmd}"
-            exit_code, output = await self._sandbox.communicate(cmd, timeout=timeout)
-            timestamp = int(time.time() * 1e9)
-            message = ProcessMessage(line=output, timestamp=timestamp, error=False)
-            self._output._add_stdout(message)
-            if self._on_stdout:
-                self._on_stdout(message)
+            await asyncio.wait_for(
+                asyncio.to_thread(stdin.write, data.encode("utf-8")), timeout=timeout
+            )
         except Exception as e:
             raise ProcessException(f"Failed to send stdin: {str(e)}") from e
 
+    async def close_stdin(self, timeout: Optional[float] = TIMEOUT) -> None:
+        """
+        Close the stdin of the running process, so that it reads EOF.
+
+        :param timeout: Seconds to wait for the process to have started
+        """
+        stdin = await self._get_stdin(timeout)
+        try:
+            stdin.close()
+        except Exception as e:
+            raise ProcessException(f"Failed to close stdin: {str(e)}") from e
+
 
 class ProcessManager:
     def __init__(
@@ -159,16 +271,27 @@ class ProcessManager:
         cwd: str = "",
         process_id: Optional[str] = None,
         timeout: Optional[float] = TIMEOUT,
+        stdin: bool = False,
     ) -> Process:
-        logger.info(f"Starting process: {cmd}")
-        env_vars = env_vars or {}
-        env_vars = {**self._sandbox.env_vars, **env_vars}
+        """
+        Start a process in the sandbox without waiting for it to finish.
+
+        :param stdin: Keep the process's stdin open for send_stdin and close_stdin;
+            by default the process reads EOF from stdin
+        """
+        logger.info("Starting process: %s", cmd)
+        # Only build a merged copy when there is something to merge; processes
+        # never mutate their env, so the sandbox's dict can be shared as is
+        if env_vars:
+            env_vars = {**self._sandbox.env_vars, **env_vars}
+        else:
+            env_vars = self._sandbox.env_vars
 
         on_stdout = on_stdout or self._on_stdout
         on_stderr = on_stderr or self._on_stderr
         on_exit = on_exit or self._on_exit
 
-        process_id = process_id or f"process_{int(time.time() * 1000)}"
+        process_id = process_id or f"process_{timestamp_ns() // 1_000_000}"
 
         if not cwd and self._sandbox.cwd:
             cwd = self._sandbox.cwd
@@ -182,10 +305,11 @@ class ProcessManager:
             on_stdout=on_stdout,
             on_stderr=on_stderr,
             on_exit=on_exit,
+            stdin=stdin,
         )
 
         await process.start()
-        logger.info(f"Started process (id: {process_id})")
+        logger.info("Started process (id: %s)", process_id)
         return process
 
     async def start_and_wait(
@@ -214,27 +338,21 @@ class ProcessManager:
         self, timeout: Optional[float] = TIMEOUT
     ) -> List[RunningProcess]:
         try:
-            cmd = "ps -eo pid,state,cmd --no-headers"
-            exit_code, output = await self._sandbox.communicate(cmd, timeout=timeout)
+            exit_code, output = await self._sandbox.communicate(
+                _PS_CMD, timeout=timeout
+            )
 
             if exit_code != 0:
                 raise ProcessException(f"Failed to list processes: {output}")
 
-            processes = []
-            for line in output.strip().split("\n"):
-                parts = line.split(None, 2)
-                if len(parts) < 3:
-                    continue
-                pid, state, cmd = parts
-                processes.append(
-                    RunningProcess(
-                        pid=int(pid),
-                        cmd=cmd.strip(),
-                        status=state.strip(),
-                    )
+            processes = [
+                RunningProcess.model_construct(
+                    pid=int(match[1]), status=match[2], cmd=match[3]
                 )
+                for match in _PS_LINE.finditer(output)
+            ]
 
-            logger.debug(f"Found processes: {processes}")
+            logger.debug("Found processes: %s", processes)
             return processes
         except Exception as e:
             raise ProcessException(f"Failed to list processes: {str(e)}") from e
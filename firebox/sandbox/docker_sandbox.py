@@ -1,14 +1,225 @@
+import functools
+import hashlib
+import io
 import os
 import asyncio
 import docker
+import shlex
+import socket
+import tarfile
+import threading
 import uuid
-from typing import Optional, Any, Dict, List, Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Any, AsyncIterator, Dict, List, Callable, Tuple, Union
 from docker.errors import APIError
 from firebox.subscriptions import SubscriptionHandler
 from firebox.models import DockerSandboxConfig, OpenPort
 from firebox.exception import SandboxException, TimeoutException
 from firebox.config import config
 from firebox.logs import logger
+from firebox.utils.clock import timestamp_ns
+from firebox.utils.ports import SCAN_PORTS_CMD, parse_listening_ports
+
+# Bytes asked of an exec's socket per read
+_SOCKET_READ_SIZE = 64 * 1024
+
+# Seconds before the first readiness retry, and the cap for the doubling delay
+_READY_RETRY_DELAY = 0.05
+_MAX_READY_RETRY_DELAY = 1
+# Only its exit code matters, so it needs neither a shell nor output
+_READY_PROBE = ["true"]
+
+# Set on images built from a Dockerfile, to skip rebuilding an unchanged one
+_CONTEXT_HASH_LABEL = "firebox.context-hash"
+
+
+@functools.lru_cache(maxsize=1)
+def get_docker_client() -> docker.DockerClient:
+    """
+    Return the Docker client shared by all sandboxes, created on first use.
+
+    Sharing it means one HTTP session and connection pool instead of one per
+    sandbox; the client is safe to use from the worker threads calls run in.
+    """
+    return docker.from_env()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_docker_pool() -> ThreadPoolExecutor:
+    # Short calls (an exec run to completion, an archive upload) share a pool
+    # bounded for all sandboxes together, so they don't pile up on the daemon
+    # without limit
+    return ThreadPoolExecutor(
+        max_workers=config.docker_pool_size, thread_name_prefix="docker-exec"
+    )
+
+
+async def _run_docker_call(func: Callable, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_docker_pool(), functools.partial(func, *args, **kwargs)
+    )
+
+
+async def _run_in_own_thread(func: Callable[[], Any]) -> Any:
+    # Output pumps block for as long as their command runs, so each gets a
+    # thread of its own rather than holding a pool's worker (the default
+    # executor's, or the one above) for that long
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(method, value):
+        if not future.done():
+            method(value)
+
+    def run():
+        try:
+            result = func()
+        except BaseException as e:
+            outcome = future.set_exception, e
+        else:
+            outcome = future.set_result, result
+        try:
+            loop.call_soon_threadsafe(settle, *outcome)
+        except RuntimeError:
+            # The loop was closed while the command was still running
+            pass
+
+    threading.Thread(target=run, name="docker-stream", daemon=True).start()
+    return await future
+
+
+def _hash_build_context(dockerfile: str, context: Optional[str]) -> str:
+    """
+    Hash a Dockerfile and its build context, to tell whether an image built
+    from them is still current.
+
+    Files of the context are hashed by path, size and modification time
+    rather than content, so an unchanged context costs a directory walk.
+    """
+    digest = hashlib.sha256()
+    # Like the build, a relative Dockerfile path is taken from the context
+    with open(os.path.join(context or "", dockerfile), "rb") as f:
+        digest.update(f.read())
+    if context:
+        for root, dirs, files in os.walk(context):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                digest.update(
+                    f"{os.path.relpath(path, context)}\0{stat.st_size}\0"
+                    f"{stat.st_mtime_ns}\0".encode("utf-8", "surrogateescape")
+                )
+    return digest.hexdigest()
+
+
+class _FrameReader:
+    """
+    Splits the output read from an exec's socket into frames.
+
+    The stream is Docker's multiplexed format, an 8 byte header (stream type,
+    3 unused, big endian size) before each frame.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        # Bytes read but not consumed yet
+        self._buffer = bytearray()
+
+    def read_frame(self) -> Optional[Tuple[int, bytes]]:
+        """
+        Read the next frame.
+
+        :return: Stream type (1 for stdout, 2 for stderr) and payload of the
+            frame, or None once the exec has closed the socket
+        """
+        # Reads large chunks and splits frames out of them, rather than two
+        # small reads per frame for its header and payload
+        buffer = self._buffer
+        while True:
+            if len(buffer) >= 8:
+                end = 8 + int.from_bytes(buffer[4:8], "big")
+                if len(buffer) >= end:
+                    frame = buffer[0], bytes(buffer[8:end])
+                    del buffer[:end]
+                    return frame
+            chunk = self._sock.recv(_SOCKET_READ_SIZE)
+            if not chunk:
+                return None
+            buffer += chunk
+
+
+class _ExecStdin:
+    """
+    The stdin of a running exec. Calls are blocking.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def write(self, data: bytes) -> None:
+        self._sock.sendall(data)
+
+    def close(self) -> None:
+        # Half-closing the socket is how the exec's stdin gets EOF; its output
+        # is still read from the other half
+        self._sock.shutdown(socket.SHUT_WR)
+
+
+class _PersistentShell:
+    """
+    A bash exec that stays open in the container and runs commands written to its stdin.
+
+    Calls are blocking and must not overlap.
+    """
+
+    def __init__(self, api, container_id: str, workdir: str):
+        exec_id = api.exec_create(
+            container_id, ["/bin/bash"], stdin=True, workdir=workdir
+        )["Id"]
+        self._socket = api.exec_start(exec_id, socket=True)
+        self._raw = getattr(self._socket, "_sock", self._socket)
+        self._frames = _FrameReader(self._raw)
+
+    def _read_frame(self) -> bytes:
+        frame = self._frames.read_frame()
+        if frame is None:
+            raise EOFError("Shell session closed")
+        return frame[1]
+
+    def run(self, command: str) -> Tuple[int, bytes]:
+        """
+        Run a command and wait for it to finish.
+
+        :param command: Command to run
+        :return: Exit code and combined stdout/stderr of the command
+        """
+        marker = f"__FB_END_{uuid.uuid4().hex}__"
+        # A subshell per command, like the `bash -c` of a fresh exec: it can't
+        # change the session's cwd or env or exit it, and reads EOF rather than
+        # the commands queued on the session's stdin
+        script = (
+            f"( eval {shlex.quote(command)} ) </dev/null 2>&1; "
+            f"printf '\\n{marker}:%d\\n' $?\n"
+        )
+        self._raw.sendall(script.encode("utf-8"))
+
+        end = f"\n{marker}:".encode("utf-8")
+        output = bytearray()
+        i = -1
+        while True:
+            searched = max(0, len(output) - len(end))
+            output += self._read_frame()
+            if i == -1:
+                i = output.find(end, searched)
+            if i != -1:
+                newline = output.find(b"\n", i + len(end))
+                if newline != -1:
+                    return int(output[i + len(end) : newline]), bytes(output[:i])
+
+    def close(self):
+        self._socket.close()
 
 
 class DockerSandbox:
@@ -17,9 +228,11 @@ class DockerSandbox:
         self.id = self.config.sandbox_id or str(uuid.uuid4())
         self.cwd = self.config.cwd
         self.env_vars = self.config.environment
-        self.client = docker.from_env()
+        self.client = get_docker_client()
         self.container = None
         self.kwargs = kwargs
+        self._shell: Optional[_PersistentShell] = None
+        self._shell_lock = asyncio.Lock()
 
     async def init(self, timeout: Optional[float] = None):
         logger.info(f"Initializing sandbox with ID: {self.id}")
@@ -62,6 +275,9 @@ class DockerSandbox:
                     "command": "tail -f /dev/null",  # Keep container running
                 }
                 self.container = self.client.containers.run(**container_config)
+                # run() starts the container but returns it with its status
+                # from before the start
+                self.container.reload()
             except docker.errors.APIError as e:
                 logger.error(f"Failed to create container: {str(e)}")
                 raise SandboxException(f"Failed to create container: {str(e)}") from e
@@ -73,8 +289,8 @@ class DockerSandbox:
             except docker.errors.APIError as e:
                 logger.error(f"Failed to start container: {str(e)}")
                 raise SandboxException(f"Failed to start container: {str(e)}") from e
+            self.container.reload()
 
-        self.container.reload()
         if self.container.status != "running":
             logs = self.container.logs().decode("utf-8")
             logger.error(f"Container failed to start. Logs:\n{logs}")
@@ -87,43 +303,62 @@ class DockerSandbox:
         await self._init_scripts()
 
     async def _build_image(self):
+        # Hashing the context and building both block, so neither runs on
+        # the event loop
+        await asyncio.to_thread(self._build_image_if_changed)
+
+    def _build_image_if_changed(self):
+        context_hash = _hash_build_context(
+            self.config.dockerfile, self.config.dockerfile_context
+        )
+        try:
+            image = self.client.images.get(self.config.image)
+            if image.labels.get(_CONTEXT_HASH_LABEL) == context_hash:
+                logger.info(
+                    "Image %s is up to date, skipping the build", self.config.image
+                )
+                return
+        except docker.errors.ImageNotFound:
+            pass
+
         logger.info(f"Building custom image for sandbox {self.id}")
         try:
             self.client.images.build(
                 path=self.config.dockerfile_context,
                 dockerfile=self.config.dockerfile,
                 tag=self.config.image,
+                labels={_CONTEXT_HASH_LABEL: context_hash},
             )
         except docker.errors.BuildError as e:
             logger.error(f"Failed to build custom image: {str(e)}")
             raise SandboxException(f"Failed to build custom image: {str(e)}") from e
 
     async def _ensure_container_ready(self, timeout: Optional[float] = None):
-        start_time = asyncio.get_event_loop().time()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        # Usually ready on the first try; back off from a short first retry
+        delay = _READY_RETRY_DELAY
         while True:
-            if timeout and asyncio.get_event_loop().time() - start_time > timeout:
-                raise TimeoutException("Container failed to become ready in time")
-
             try:
-                exit_code, output = await self.communicate(
-                    "echo 'Container is ready'", timeout=1
-                )
-                if exit_code == 0 and "Container is ready" in output:
-                    break
+                exit_code, _ = await self.communicate(_READY_PROBE, timeout=1)
+                if exit_code == 0:
+                    return
             except Exception:
                 pass
-            await asyncio.sleep(0.1)
+
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise TimeoutException("Container failed to become ready in time")
+                delay = min(delay, remaining)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _MAX_READY_RETRY_DELAY)
 
     async def _init_scripts(self):
         logger.info("Initializing scripts")
-        commands = [
-            "source /root/.bashrc",
-            "mkdir -p /root/commands",
-            "touch /root/commands/__init__.py",
-            "export PATH=$PATH:/root/commands",
-        ]
-        for cmd in commands:
-            await self.communicate(cmd)
+        # Uploading the package marker creates /root/commands along with it,
+        # without an exec
+        await self.put_files({"/root/commands/__init__.py": b""})
 
     async def _subscribe(
         self,
@@ -139,24 +374,267 @@ class DockerSandbox:
             raise NotImplementedError(f"Subscription method {method} not implemented")
 
     async def communicate(
-        self, command: str, timeout: Optional[float] = None
-    ) -> tuple[int, str]:
-        logger.info(f"Executing command: {command}")
-        try:
-            exec_result = await asyncio.to_thread(
-                self.container.exec_run,
-                cmd=["/bin/bash", "-c", command],
-                workdir=self.config.cwd,
+        self,
+        command: Union[str, List[str]],
+        timeout: Optional[float] = None,
+        environment: Optional[Dict[str, str]] = None,
+        workdir: Optional[str] = None,
+        binary: bool = False,
+    ) -> Tuple[int, Union[str, bytes]]:
+        """
+        Run a command to completion.
+
+        :param command: Shell command to run, or an argv list to run as is, without
+            a shell to parse it
+        :param timeout: Timeout for the call
+        :param environment: Environment variables for the command, on top of the container's
+        :param workdir: Working directory for the command, defaults to the sandbox cwd
+        :param binary: Return the output as the raw bytes, skipping the decode and strip
+            for output that is parsed as bytes anyway
+        :return: Exit code and combined stdout/stderr of the command
+        """
+        logger.info("Executing command: %s", command)
+        # The persistent shell has the container's env and the sandbox cwd, so
+        # commands that need others get an exec of their own
+        if self.config.persistent_shell and not (environment or workdir):
+            if not isinstance(command, str):
+                command = shlex.join(command)
+            exit_code, output = await self._communicate_persistent(command)
+        else:
+            if isinstance(command, str):
+                command = ["/bin/bash", "-c", command]
+            try:
+                exec_result = await _run_docker_call(
+                    self.container.exec_run,
+                    cmd=command,
+                    environment=environment or None,
+                    workdir=workdir or self.config.cwd,
+                )
+            except Exception as e:
+                logger.error("Command execution failed: %s", e)
+                raise SandboxException(f"Command execution failed: {str(e)}") from e
+            exit_code, output = exec_result.exit_code, exec_result.output
+
+        if binary:
+            logger.info(
+                "Command output: %s bytes, exit code: %s", len(output), exit_code
             )
-            output = exec_result.output.decode("utf-8").strip()
-            exit_code = exec_result.exit_code
-            logger.info(f"Command output: '{output}', exit code: {exit_code}")
             return exit_code, output
+        output = output.decode("utf-8").strip()
+        logger.info("Command output: '%s', exit code: %s", output, exit_code)
+        return exit_code, output
+
+    async def _communicate_persistent(self, command: str) -> Tuple[int, bytes]:
+        async with self._shell_lock:
+            try:
+                if self._shell is None:
+                    self._shell = await _run_docker_call(
+                        _PersistentShell,
+                        self.client.api,
+                        self.container.id,
+                        self.config.cwd,
+                    )
+                exit_code, output = await _run_docker_call(self._shell.run, command)
+            except Exception as e:
+                # The session is in an unknown state, start a new one next time
+                self._close_shell()
+                logger.error("Command execution failed: %s", e)
+                raise SandboxException(f"Command execution failed: {str(e)}") from e
+        return exit_code, output
+
+    def _close_shell(self):
+        if self._shell is not None:
+            try:
+                self._shell.close()
+            except Exception:
+                pass
+            self._shell = None
+
+    async def put_files(self, files: Dict[str, bytes], mode: int = 0o644) -> None:
+        """
+        Write files into the container in one archive upload, without an exec.
+
+        :param files: Content by absolute path, missing parent directories are created
+        :param mode: Permission bits for the files
+        """
+        archive = io.BytesIO()
+        mtime = timestamp_ns() // 1_000_000_000
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            for path, content in files.items():
+                info = tarfile.TarInfo(path.lstrip("/"))
+                info.size = len(content)
+                info.mode = mode
+                info.mtime = mtime
+                tar.addfile(info, io.BytesIO(content))
+        try:
+            await _run_docker_call(self.container.put_archive, "/", archive.getvalue())
+        except Exception as e:
+            logger.error("Failed to write files: %s", e)
+            raise SandboxException(f"Failed to write files: {str(e)}") from e
+
+    async def stream(
+        self, command: str, environment: Optional[Dict[str, str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Run a long-lived command and yield its output line by line as it is produced.
+
+        :param command: Command to run
+        :param environment: Environment variables for the command, on top of the container's
+        """
+        logger.info("Streaming command: %s", command)
+        loop = asyncio.get_running_loop()
+        lines: asyncio.Queue = asyncio.Queue()
+        api = self.client.api
+        try:
+            exec_id = (
+                await _run_docker_call(
+                    api.exec_create,
+                    self.container.id,
+                    cmd=["/bin/bash", "-c", command],
+                    environment=environment or None,
+                    workdir=self.config.cwd,
+                )
+            )["Id"]
+            # The raw socket rather than docker-py's frame generator, so that
+            # the read can be interrupted if the consumer stops early
+            sock = await _run_docker_call(api.exec_start, exec_id, socket=True)
+        except Exception as e:
+            logger.error("Command streaming failed: %s", e)
+            raise SandboxException(f"Command streaming failed: {str(e)}") from e
+        raw = getattr(sock, "_sock", sock)
+
+        def pump():
+            try:
+                frames = _FrameReader(raw)
+                pending = b""
+                while (frame := frames.read_frame()) is not None:
+                    *complete, pending = (pending + frame[1]).split(b"\n")
+                    for line in complete:
+                        loop.call_soon_threadsafe(
+                            lines.put_nowait, line.decode("utf-8")
+                        )
+                if pending:
+                    loop.call_soon_threadsafe(lines.put_nowait, pending.decode("utf-8"))
+            finally:
+                loop.call_soon_threadsafe(lines.put_nowait, None)
+
+        pump_task = asyncio.ensure_future(_run_in_own_thread(pump))
+        finished = False
+        try:
+            while (line := await lines.get()) is not None:
+                yield line
+            finished = True
+        finally:
+            if not finished:
+                # The consumer stopped early: wake the pump's blocked read so
+                # its thread exits; the command itself keeps running
+                try:
+                    raw.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            try:
+                await pump_task
+            except Exception as e:
+                if finished:
+                    logger.error("Command streaming failed: %s", e)
+                    raise SandboxException(f"Command streaming failed: {str(e)}") from e
+            finally:
+                sock.close()
+
+    async def exec_streaming(
+        self,
+        command: str,
+        on_output: Callable[[List[Tuple[bool, str, int]]], None],
+        environment: Optional[Dict[str, str]] = None,
+        workdir: Optional[str] = None,
+        on_stdin: Optional[Callable[[_ExecStdin], None]] = None,
+    ) -> int:
+        """
+        Run a command to completion, reporting stdout/stderr lines as soon as they are read.
+
+        :param command: Command to run
+        :param on_output: Called on the event loop with the (is_stderr, line, timestamp in ns)
+            tuples of every complete line in one read, in order
+        :param environment: Environment variables for the command, on top of the container's
+        :param workdir: Working directory for the command, defaults to the sandbox cwd
+        :param on_stdin: If given, the command's stdin is kept open and this is called
+            on the event loop with it once the command has started; otherwise the
+            command reads EOF from stdin
+        :return: Exit code of the command
+        """
+        logger.info("Executing command (streaming): %s", command)
+        loop = asyncio.get_running_loop()
+        api = self.client.api
+
+        def read_stdin_exec(exec_id: str):
+            sock = api.exec_start(exec_id, socket=True)
+            raw = getattr(sock, "_sock", sock)
+            loop.call_soon_threadsafe(on_stdin, _ExecStdin(raw))
+            frames = _FrameReader(raw)
+            try:
+                while (frame := frames.read_frame()) is not None:
+                    stream, data = frame
+                    yield (None, data) if stream == 2 else (data, None)
+            finally:
+                sock.close()
+
+        def pump() -> int:
+            exec_id = api.exec_create(
+                self.container.id,
+                cmd=["/bin/bash", "-c", command],
+                environment=environment or None,
+                workdir=workdir or self.config.cwd,
+                stdin=on_stdin is not None,
+            )["Id"]
+            pending = [b"", b""]
+
+            def split(is_stderr: int, data: bytes, timestamp: int, batch: list):
+                # Decode all complete lines of a read at once; b"\n" can't occur
+                # inside a multi-byte UTF-8 sequence
+                complete, newline, pending[is_stderr] = data.rpartition(b"\n")
+                if newline:
+                    text = complete.decode("utf-8", "replace")
+                    batch.extend(
+                        (bool(is_stderr), line, timestamp) for line in text.split("\n")
+                    )
+
+            if on_stdin is None:
+                output = api.exec_start(exec_id, stream=True, demux=True)
+            else:
+                # The stdin path needs the raw socket, so frames are split here
+                # rather than by docker-py's demux
+                output = read_stdin_exec(exec_id)
+
+            # One hop onto the event loop per read instead of one per line
+            for chunks in output:
+                timestamp = timestamp_ns()
+                batch = []
+                for is_stderr, chunk in enumerate(chunks):
+                    if chunk:
+                        split(is_stderr, pending[is_stderr] + chunk, timestamp, batch)
+                if batch:
+                    loop.call_soon_threadsafe(on_output, batch)
+
+            timestamp = timestamp_ns()
+            batch = [
+                (bool(is_stderr), rest.decode("utf-8", "replace"), timestamp)
+                for is_stderr, rest in enumerate(pending)
+                if rest
+            ]
+            if batch:
+                loop.call_soon_threadsafe(on_output, batch)
+            return api.exec_inspect(exec_id)["ExitCode"]
+
+        try:
+            exit_code = await _run_in_own_thread(pump)
         except Exception as e:
-            logger.error(f"Command execution failed: {str(e)}")
+            logger.error("Command execution failed: %s", e)
             raise SandboxException(f"Command execution failed: {str(e)}") from e
+        logger.info("Command exited with code %s", exit_code)
+        return exit_code
 
     async def stop(self):
+        self._close_shell()
         if self.container:
             self.container.stop()
             logger.info(f"Container {self.id} stopped")
@@ -167,6 +645,7 @@ class DockerSandbox:
             logger.info(f"Container {self.id} started")
 
     async def remove(self):
+        self._close_shell()
         if self.container:
             self.container.remove(v=True, force=True)
             self.container = None
@@ -186,42 +665,37 @@ class DockerSandbox:
 
     @staticmethod
     async def list() -> List[Dict[str, Any]]:
-        client = docker.from_env()
-        containers = client.containers.list(
+        # The summaries of one list call have everything needed; containers.list
+        # would inspect every container with a request of its own
+        summaries = get_docker_client().api.containers(
             filters={"name": f"{config.container_prefix}_"}
         )
         return [
             {
-                "sandbox_id": container.name.split("_")[-1],
-                "status": container.status,
-                "metadata": container.labels.get("metadata", {}),
+                "sandbox_id": summary["Names"][0].split("_")[-1],
+                "status": summary["State"],
+                "metadata": (summary["Labels"] or {}).get("metadata", {}),
             }
-            for container in containers
+            for summary in summaries
         ]
 
     async def scan_ports(self) -> List[OpenPort]:
-        # Implement port scanning logic here
-        # This is a placeholder implementation
-        result, _ = await self.communicate("netstat -tuln | grep LISTEN")
-        ports = []
-        for line in result.split("\n"):
-            if line.strip():
-                parts = line.split()
-                if len(parts) >= 4:
-                    ip, port = parts[3].rsplit(":", 1)
-                    ports.append(OpenPort(ip=ip, port=int(port), state="LISTEN"))
-        return ports
+        _, result = await self.communicate(SCAN_PORTS_CMD)
+        return parse_listening_ports(result)
 
     @classmethod
     def get(cls, sandbox_id: str):
-        client = docker.from_env()
+        client = get_docker_client()
         try:
             container = client.containers.get(f"{sandbox_id}")
-            config = DockerSandboxConfig(
+            # Built from what Docker reports about an existing container, so
+            # there is nothing to validate
+            env = container.attrs["Config"]["Env"] or []
+            config = DockerSandboxConfig.model_construct(
                 sandbox_id=sandbox_id,
                 image=container.image.tags[0] if container.image.tags else "unknown",
                 cwd=container.attrs["Config"]["WorkingDir"],
-                environment=container.attrs["Config"]["Env"],
+                environment=dict(item.partition("=")[::2] for item in env),
             )
             sandbox = cls(config)
             sandbox.container = container
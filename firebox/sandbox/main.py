@@ -2,13 +2,13 @@ import docker
 import asyncio
 from typing import Any, Callable, Dict, List, Optional, Union
 
-from .docker_sandbox import DockerSandbox
+from .docker_sandbox import DockerSandbox, get_docker_client
 from firebox.filesystem import FilesystemManager
 from firebox.process import ProcessManager, Process, ProcessMessage, ProcessOutput
 from firebox.terminal import TerminalManager
 from firebox.code_snippet import CodeSnippetManager, OpenPort
 from firebox.models import DockerSandboxConfig, EnvVars, SandboxStatus, SandboxInfo
-from firebox.exception import SandboxException
+from firebox.exception import SandboxException, TimeoutException
 from firebox.constants import TIMEOUT, DOMAIN
 from firebox.logs import logger
 
@@ -33,6 +33,10 @@ class Sandbox:
     def filesystem(self) -> FilesystemManager:
         return self._filesystem
 
+    @property
+    def code_snippet(self) -> CodeSnippetManager:
+        return self._code_snippet
+
     @property
     def id(self) -> str:
         return self._docker_sandbox.id
@@ -43,7 +47,7 @@ class Sandbox:
 
     @property
     def is_open(self) -> bool:
-        return self._status == SandboxStatus.RUNNING
+        return self._status is SandboxStatus.RUNNING
 
     @property
     def cwd(self):
@@ -104,7 +108,21 @@ class Sandbox:
         self._status = SandboxStatus.CREATED
 
         # Automatically open the sandbox
-        asyncio.create_task(self._open(timeout))
+        self._opening = asyncio.create_task(self._open(timeout))
+
+    async def wait_until_open(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait for the sandbox to finish opening, instead of polling its status.
+
+        :param timeout: Seconds to wait, or None to wait as long as opening takes
+        :raises SandboxException: If opening the sandbox failed
+        :raises TimeoutException: If the sandbox did not open within the timeout
+        """
+        try:
+            # Shielded so a timeout here doesn't cancel the opening itself
+            await asyncio.wait_for(asyncio.shield(self._opening), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutException(f"Sandbox did not open within {timeout} seconds")
 
     async def _open(self, timeout: Optional[float] = TIMEOUT) -> None:
         logger.info(
@@ -112,7 +130,9 @@ class Sandbox:
         )
         try:
             await self._docker_sandbox.init(timeout=timeout)
-            asyncio.create_task(self._code_snippet.subscribe())
+            # subscribe() only schedules the port scanner task, so it's awaited
+            # directly instead of being wrapped in a task of its own
+            await self._code_snippet.subscribe()
             logger.info(f"Sandbox opened successfully")
 
             if self._cwd:
@@ -125,10 +145,11 @@ class Sandbox:
             raise SandboxException(f"Failed to open sandbox: {str(e)}") from e
 
     async def close(self) -> None:
-        if self._status == SandboxStatus.RELEASED:
+        if self._status is SandboxStatus.RELEASED:
             raise SandboxException("Cannot close a released sandbox")
 
         logger.info(f"Closing sandbox {self.id}")
+        self._code_snippet.unsubscribe()
         await self._docker_sandbox.stop()
         self._status = SandboxStatus.CLOSED
         Sandbox._closed_sandboxes[self.id] = self
@@ -136,6 +157,7 @@ class Sandbox:
 
     async def release(self) -> None:
         logger.info(f"Releasing sandbox {self.id}")
+        self._code_snippet.unsubscribe()
         await self._docker_sandbox.remove()
         self._status = SandboxStatus.RELEASED
         if self.id in Sandbox._closed_sandboxes:
@@ -170,14 +192,23 @@ class Sandbox:
 
     @staticmethod
     def list(include_closed=False) -> List[SandboxInfo]:
-        docker_client = docker.from_env()
+        docker_client = get_docker_client()
+        # The tags of every image in one call; container.image would fetch
+        # each container's image with a request of its own
+        image_tags = {
+            image["Id"]: [
+                tag for tag in image["RepoTags"] or () if tag != "<none>:<none>"
+            ]
+            for image in docker_client.api.images()
+        }
         sandboxes = []
         for container in docker_client.containers.list(
             all=True, filters={"name": "firebox-sandbox_"}
         ):
             sandbox_id = container.name.split("_")[1]
+            tags = image_tags.get(container.attrs["Image"])
             sandboxes.append(
-                SandboxInfo(
+                SandboxInfo.model_construct(
                     sandbox_id=sandbox_id,
                     status=(
                         SandboxStatus.RUNNING
@@ -186,11 +217,7 @@ class Sandbox:
                     ),
                     metadata={
                         "name": container.name,
-                        "image": (
-                            container.image.tags[0]
-                            if container.image.tags
-                            else "unknown"
-                        ),
+                        "image": tags[0] if tags else "unknown",
                         "created": container.attrs["Created"],
                     },
                 )
@@ -198,7 +225,7 @@ class Sandbox:
         if include_closed:
             sandboxes.extend(
                 [
-                    SandboxInfo(
+                    SandboxInfo.model_construct(
                         sandbox_id=s.id,
                         status=s.status,
                         metadata={
@@ -214,7 +241,7 @@ class Sandbox:
 
     @staticmethod
     def kill(sandbox_id: str, domain: str = DOMAIN) -> None:
-        docker_client = docker.from_env()
+        docker_client = get_docker_client()
         try:
             container = docker_client.containers.get(sandbox_id)
             container.remove(force=True)
@@ -231,6 +258,7 @@ class Sandbox:
         env_vars: Optional[EnvVars] = None,
         cwd: Optional[str] = None,
         timeout: Optional[float] = TIMEOUT,
+        stdin: bool = False,
     ) -> Process:
         return await self._process.start(
             cmd,
@@ -240,6 +268,7 @@ class Sandbox:
             env_vars,
             cwd or self.cwd,
             timeout=timeout,
+            stdin=stdin,
         )
 
     async def start_and_wait(
@@ -1,8 +1,11 @@
 import asyncio
 import os
-import time
+import shlex
+import uuid
 from typing import Callable, Any
 
+from firebox.constants import TIMEOUT
+
 from firebox.models import (
     FilesystemEvent,
     FilesystemOperation,
@@ -10,6 +13,24 @@ from firebox.models import (
     ProcessEventType,
 )
 from firebox.logs import logger
+from firebox.utils.clock import timestamp_ns
+from firebox.utils.signals import signal_by_env_cmd
+from firebox.utils.tasks import create_eager_task
+
+# Seconds between polls, and the cap for the doubling delay after failures
+_POLL_INTERVAL = 1
+_MAX_RETRY_DELAY = 60
+
+# Set on a directory watch's exec, to find it when unsubscribing
+_WATCH_TOKEN_ENV_VAR = "FIREBOX_WATCH_TOKEN"
+
+# inotifywait event names -> operation reported to listeners
+_INOTIFY_OPERATIONS = {
+    "CREATE": FilesystemOperation.Create,
+    "MOVED_TO": FilesystemOperation.Create,
+    "DELETE": FilesystemOperation.Remove,
+    "MOVED_FROM": FilesystemOperation.Remove,
+}
 
 
 class SubscriptionHandler:
@@ -17,19 +38,125 @@ class SubscriptionHandler:
     async def watch_directory(
         sandbox, path: str, handler: Callable[[FilesystemEvent], None]
     ):
-        previous_state = set()
+        exit_code, _ = await sandbox.communicate("command -v inotifywait")
+        if exit_code == 0:
+            return SubscriptionHandler._watch_directory_inotify(sandbox, path, handler)
+
+        logger.debug("inotifywait not available, polling %s", path)
+        return SubscriptionHandler._watch_directory_polling(sandbox, path, handler)
+
+    @staticmethod
+    def _watch_directory_inotify(
+        sandbox, path: str, handler: Callable[[FilesystemEvent], None]
+    ):
+        # The watch is found by a token in its environment to be killed inside
+        # the container on unsubscribe. The shell prints an empty line once it
+        # runs, before exec'ing inotifywait with the same environment.
+        token = uuid.uuid4().hex
+        command = (
+            "echo; exec inotifywait -m -q "
+            "-e create,delete,moved_to,moved_from "
+            f"--format '%e %f' {shlex.quote(path)}"
+        )
+        started = asyncio.Event()
+        # Unsubscribe of the polling watch taken over if inotifywait stops
+        fallback = None
+
+        async def read_events():
+            nonlocal fallback
+            try:
+                lines = sandbox.stream(
+                    command, environment={_WATCH_TOKEN_ENV_VAR: token}
+                )
+                await lines.__anext__()
+                started.set()
+                async for line in lines:
+                    events, _, file_name = line.partition(" ")
+                    events = events.split(",")
+                    operation = next(
+                        (
+                            _INOTIFY_OPERATIONS[e]
+                            for e in events
+                            if e in _INOTIFY_OPERATIONS
+                        ),
+                        None,
+                    )
+                    if operation is None or not file_name:
+                        continue
+                    handler(
+                        FilesystemEvent.model_construct(
+                            path=os.path.join(path, file_name),
+                            name=file_name,
+                            operation=operation,
+                            timestamp=timestamp_ns(),
+                            is_dir="ISDIR" in events,
+                        )
+                    )
+                logger.warning(
+                    "inotifywait stopped watching %s, falling back to polling", path
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(
+                    "inotifywait failed watching %s, falling back to polling", path
+                )
+            # E.g. the path is gone or the inotify watch limit was reached
+            fallback = SubscriptionHandler._watch_directory_polling(
+                sandbox, path, handler
+            )
+
+        task = create_eager_task(read_events())
+
+        async def unsubscribe():
+            # Until the watch has started there is nothing to kill yet, and
+            # killing too early would leave it running, so wait for it unless
+            # it has failed
+            waiter = create_eager_task(started.wait())
+            await asyncio.wait(
+                (waiter, task), timeout=TIMEOUT, return_when=asyncio.FIRST_COMPLETED
+            )
+            waiter.cancel()
+            task.cancel()
+            if started.is_set():
+                try:
+                    await sandbox.communicate(
+                        signal_by_env_cmd(_WATCH_TOKEN_ENV_VAR, token)
+                    )
+                except Exception as e:
+                    logger.warning("Failed to stop watching %s: %s", path, e)
+            if fallback:
+                await fallback()
+
+        return unsubscribe
+
+    @staticmethod
+    def _watch_directory_polling(
+        sandbox, path: str, handler: Callable[[FilesystemEvent], None]
+    ):
+        previous_state = frozenset()
+        previous_mtime = None
+        quoted_path = shlex.quote(path)
+        # Only the previous mtime changes between ticks
+        stat_cmd = f'm=$(stat -c %y {quoted_path}) || exit 1; echo "$m"; [ "$m" = '
+        list_cmd = f" ] || ls -la {quoted_path}"
 
         async def poll_changes():
-            nonlocal previous_state
+            nonlocal previous_state, previous_mtime
+            retry_delay = _POLL_INTERVAL
             while True:
                 try:
-                    exit_code, output = await sandbox.communicate(f"ls -la {path}")
-                    if exit_code == 0:
-                        current_state = set(output.splitlines())
-                        new_files = current_state - previous_state
-                        removed_files = previous_state - current_state
+                    # One round trip: print the directory mtime, and list it
+                    # only when that differs from the last tick's.
+                    exit_code, output = await sandbox.communicate(
+                        stat_cmd + shlex.quote(previous_mtime or "") + list_cmd
+                    )
+                    mtime, _, listing = output.partition("\n")
+                    if exit_code == 0 and mtime != previous_mtime:
+                        previous_mtime = mtime
+                        current_state = frozenset(listing.splitlines())
 
-                        for file_info in new_files.union(removed_files):
+                        for file_info in previous_state ^ current_state:
                             parts = file_info.split()
                             if len(parts) >= 9:
                                 file_name = " ".join(parts[8:])
@@ -40,74 +167,77 @@ class SubscriptionHandler:
                                     is_dir = parts[0].startswith("d")
                                     operation = (
                                         FilesystemOperation.Create
-                                        if file_info in new_files
+                                        if file_info in current_state
                                         else FilesystemOperation.Remove
                                     )
-                                    event = FilesystemEvent(
+                                    event = FilesystemEvent.model_construct(
                                         path=os.path.join(path, file_name),
                                         name=file_name,
                                         operation=operation,
-                                        timestamp=int(time.time() * 1e9),
+                                        timestamp=timestamp_ns(),
                                         is_dir=is_dir,
                                     )
                                     handler(event)
 
                         previous_state = current_state
 
-                    await asyncio.sleep(1)  # Poll every second
-                except Exception as e:
-                    logger.error(f"Error in file watcher: {str(e)}")
-                    await asyncio.sleep(1)  # Wait before retrying
+                    retry_delay = _POLL_INTERVAL
+                    await asyncio.sleep(_POLL_INTERVAL)
+                except Exception:
+                    logger.exception("Error in file watcher")
+                    await asyncio.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, _MAX_RETRY_DELAY)
 
-        task = asyncio.create_task(poll_changes())
+        task = create_eager_task(poll_changes())
 
-        def unsubscribe():
+        async def unsubscribe():
             task.cancel()
 
         return unsubscribe
 
     @staticmethod
     async def watch_process(sandbox, pid: int, handler: Callable[[ProcessEvent], None]):
+        # One exec per tick: the process state, then the last stdout and stderr
+        # lines, NUL separated. Fails when the process doesn't exist.
+        status_cmd = (
+            f"s=$(ps -p {pid} -o state=) || exit 1; printf '%s\\0' \"$s\"; "
+            f"tail -n 1 /proc/{pid}/fd/1; printf '\\0'; tail -n 1 /proc/{pid}/fd/2"
+        )
+
         async def poll_process():
+            retry_delay = _POLL_INTERVAL
             while True:
                 try:
-                    exit_code, output = await sandbox.communicate(
-                        f"ps -p {pid} -o state="
-                    )
+                    exit_code, output = await sandbox.communicate(status_cmd)
                     if exit_code == 0:
-                        if output.strip():
-                            # Process is running, check for output
-                            stdout, _ = await sandbox.communicate(
-                                f"tail -n 1 /proc/{pid}/fd/1"
-                            )
-                            if stdout:
+                        state, _, streams = output.partition("\0")
+                        stdout, _, stderr = streams.partition("\0")
+                        if state.strip():
+                            # Process is running, report its latest output
+                            if stdout.strip():
                                 event = ProcessEvent(
                                     pid=pid,
                                     event_type=ProcessEventType.STDOUT,
-                                    timestamp=int(time.time() * 1e9),
+                                    timestamp=timestamp_ns(),
                                     data=stdout.strip(),
                                 )
                                 handler(event)
 
-                            stderr, _ = await sandbox.communicate(
-                                f"tail -n 1 /proc/{pid}/fd/2"
-                            )
-                            if stderr:
+                            if stderr.strip():
                                 event = ProcessEvent(
                                     pid=pid,
                                     event_type=ProcessEventType.STDERR,
-                                    timestamp=int(time.time() * 1e9),
+                                    timestamp=timestamp_ns(),
                                     data=stderr.strip(),
                                 )
                                 handler(event)
                         else:
                             # Process has exited
-                            exit_code, _ = await sandbox.communicate(f"echo $?")
                             event = ProcessEvent(
                                 pid=pid,
                                 event_type=ProcessEventType.EXIT,
-                                timestamp=int(time.time() * 1e9),
-                                exit_code=int(exit_code),
+                                timestamp=timestamp_ns(),
+                                exit_code=0,
                             )
                             handler(event)
                             break
@@ -116,16 +246,18 @@ class SubscriptionHandler:
                         event = ProcessEvent(
                             pid=pid,
                             event_type=ProcessEventType.EXIT,
-                            timestamp=int(time.time() * 1e9),
+                            timestamp=timestamp_ns(),
                             exit_code=-1,
                         )
                         handler(event)
                         break
 
-                    await asyncio.sleep(1)  # Poll every second
-                except Exception as e:
-                    logger.error(f"Error in process watcher: {str(e)}")
-                    await asyncio.sleep(1)  # Wait before retrying
+                    retry_delay = _POLL_INTERVAL
+                    await asyncio.sleep(_POLL_INTERVAL)
+                except Exception:
+                    logger.exception("Error in process watcher")
+                    await asyncio.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, _MAX_RETRY_DELAY)
 
         task = asyncio.create_task(poll_process())
 
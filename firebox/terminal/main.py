@@ -24,21 +24,22 @@ class Terminal:
         self._on_exit = on_exit
         self._output = TerminalOutput()
         self._finished = asyncio.Future()
+        self._input_file = f"/tmp/terminal_{terminal_id}_input"
+        self._tail_cmd = f"tail -n +1 -F /tmp/terminal_{terminal_id}_output 2>/dev/null"
+        self._kill_cmd = f"pkill -f 'terminal_{terminal_id}'"
         self._read_task = asyncio.create_task(self._read_output())
 
     async def _read_output(self):
+        # A single long-lived tail follows the output file, on a thread of its
+        # own; kill() ends it via pkill, since its command line contains the
+        # terminal id, and waits for the stream to finish.
         try:
-            while not self._finished.done():
-                result = await self._sandbox.communicate(
-                    f"cat /tmp/terminal_{self._terminal_id}_output"
-                )
-                if result[0] == 0 and result[1]:
-                    data = result[1]
-                    self._output._add_data(data)
-                    self._on_data(data)
-                await asyncio.sleep(0.1)
+            async for line in self._sandbox.stream(self._tail_cmd):
+                data = line + "\n"
+                self._output._add_data(data)
+                self._on_data(data)
         except Exception as e:
-            logger.error(f"Error reading from terminal: {str(e)}")
+            logger.error("Error reading from terminal: %s", e)
         finally:
             if self._on_exit:
                 self._on_exit()
@@ -46,7 +47,7 @@ class Terminal:
     async def send_data(self, data: str, timeout: Optional[float] = TIMEOUT) -> None:
         try:
             await self._sandbox.communicate(
-                f"echo '{data}' >> /tmp/terminal_{self._terminal_id}_input",
+                f"echo '{data}' >> {self._input_file}",
                 timeout=timeout,
             )
         except Exception as e:
@@ -54,10 +55,14 @@ class Terminal:
 
     async def kill(self, timeout: Optional[float] = TIMEOUT) -> None:
         try:
-            await self._sandbox.communicate(
-                f"pkill -f 'terminal_{self._terminal_id}'", timeout=timeout
-            )
-            self._finished.set_result(None)
+            await self._sandbox.communicate(self._kill_cmd, timeout=timeout)
+            # The tail is gone, so its stream ends; stop following it anyway
+            # if that takes too long
+            _, pending = await asyncio.wait((self._read_task,), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if not self._finished.done():
+                self._finished.set_result(None)
         except Exception as e:
             raise TerminalException(f"Failed to kill terminal: {str(e)}") from e
 
@@ -83,11 +88,10 @@ class TerminalManager:
         if not cwd and self._sandbox.cwd:
             cwd = self._sandbox.cwd
 
-        env_vars_str = " ".join(f"{k}={v}" for k, v in (env_vars or {}).items())
-
-        # Start a background process in the sandbox to simulate a terminal
+        # Start a background process in the sandbox to simulate a terminal; env
+        # and cwd are set on the exec itself rather than through the command
         terminal_cmd = f'while true; do if [ -f /tmp/terminal_{terminal_id}_input ]; then bash -c "$(cat /tmp/terminal_{terminal_id}_input)"; > /tmp/terminal_{terminal_id}_input; fi; sleep 0.1; done > /tmp/terminal_{terminal_id}_output 2>&1 &'
-        await self._sandbox.communicate(f"{env_vars_str} cd {cwd} && {terminal_cmd}")
+        await self._sandbox.communicate(terminal_cmd, environment=env_vars, workdir=cwd)
 
         if cmd:
             await self._sandbox.communicate(
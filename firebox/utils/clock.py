@@ -0,0 +1,15 @@
+import time
+
+# Wall-clock time at import, paired with the monotonic clock at the same moment
+_WALL_BASE_NS = time.time_ns()
+_MONOTONIC_BASE_NS = time.monotonic_ns()
+
+
+def timestamp_ns() -> int:
+    """
+    Current Unix time in nanoseconds, advanced by the monotonic clock.
+
+    Timestamps taken through this never go backwards within a process, even if the
+    system clock is adjusted, so they are safe to order output and events by.
+    """
+    return _WALL_BASE_NS + (time.monotonic_ns() - _MONOTONIC_BASE_NS)
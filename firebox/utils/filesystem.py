@@ -1,29 +1,36 @@
+import functools
 import warnings
 
 from pathlib import PurePosixPath
-from typing import Optional
+from typing import Optional, Tuple
 
 
 def resolve_path(path: str, cwd: Optional[str] = None) -> str:
+    result, warning = _resolve(path, cwd)
+    if warning:
+        warnings.warn(warning)
+    return result
+
+
+@functools.lru_cache(maxsize=4096)
+def _resolve(path: str, cwd: Optional[str]) -> Tuple[str, Optional[str]]:
+    # Pure function of (path, cwd), so results are cached; a changed cwd is
+    # simply a different key. Warnings are returned rather than emitted so
+    # that cache hits still warn.
     warning = f"Path starts with {{0}} and cwd isn't set. The path {path} will evaluate to `{{1}}`, which may not be what you want."
     if path.startswith("./"):
         result = PurePosixPath(cwd or "/sandbox", path).as_posix()
-        if not cwd:
-            warnings.warn(warning.format("./", result))
-        return result
+        return result, None if cwd else warning.format("./", result)
 
     if path.startswith("../"):
         result = PurePosixPath(cwd or "/sandbox", path).as_posix()
-        if not cwd:
-            warnings.warn(warning.format("../", result))
-        return result
+        return result, None if cwd else warning.format("../", result)
 
     if path.startswith("~/"):
         result = PurePosixPath("/sandbox", path[2:]).as_posix()
-        warnings.warn(warning.format("~/", result))
-        return result
+        return result, warning.format("~/", result)
 
     if not path.startswith("/") and cwd:
-        return PurePosixPath(cwd, path).as_posix()
+        return PurePosixPath(cwd, path).as_posix(), None
 
-    return path
+    return path, None
@@ -0,0 +1,43 @@
+import functools
+import re
+import socket
+from typing import List
+
+from firebox.models import OpenPort
+
+# The kernel's socket tables, read directly instead of running netstat to
+# format them; tcp6 is missing when IPv6 is disabled, which cat reports on
+# stderr while still printing tcp
+SCAN_PORTS_CMD = ["cat", "/proc/net/tcp", "/proc/net/tcp6"]
+
+# Local address and port of a socket in state 0A (LISTEN), all hex
+_PROC_NET_LISTEN = re.compile(
+    r"^\s*\d+:\s+([0-9A-F]+):([0-9A-F]{4})\s+[0-9A-F]+:[0-9A-F]{4}\s+0A\s",
+    re.MULTILINE,
+)
+
+
+@functools.lru_cache(maxsize=256)
+def _decode_address(address: str) -> str:
+    # The kernel prints the address as 32-bit words in host (little endian)
+    # byte order: one word for IPv4, four for IPv6
+    packed = b"".join(
+        bytes.fromhex(address[i : i + 8])[::-1] for i in range(0, len(address), 8)
+    )
+    family = socket.AF_INET if len(packed) == 4 else socket.AF_INET6
+    return socket.inet_ntop(family, packed)
+
+
+def parse_listening_ports(output: str) -> List[OpenPort]:
+    """
+    Parse the listening sockets out of /proc/net/tcp and /proc/net/tcp6.
+
+    :param output: Contents of the tables, other rows and lines are skipped
+    :return: An OpenPort per listening socket
+    """
+    return [
+        OpenPort.model_construct(
+            ip=_decode_address(address), port=int(port, 16), state="LISTEN"
+        )
+        for address, port in _PROC_NET_LISTEN.findall(output)
+    ]
@@ -0,0 +1,20 @@
+import shlex
+
+
+def signal_by_env_cmd(name: str, value: str, signal: str = "TERM") -> str:
+    """
+    Build a shell command that signals every process in the container whose
+    environment has `name` set to `value`.
+
+    Unlike a pid, the variable is known before the process starts, and it is
+    inherited by everything the process spawns.
+
+    :param name: Environment variable name
+    :param value: Value identifying the processes
+    :param signal: Signal name without the SIG prefix
+    """
+    return (
+        f"pids=$(grep -lzxF {shlex.quote(f'{name}={value}')} "
+        "/proc/[0-9]*/environ 2>/dev/null | cut -d/ -f3); "
+        f'[ -z "$pids" ] || kill -{signal} $pids'
+    )
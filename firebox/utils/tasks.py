@@ -0,0 +1,18 @@
+import asyncio
+import sys
+from typing import Any, Coroutine
+
+
+def create_eager_task(coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    """
+    Schedule a coroutine, running it eagerly up to its first suspension where supported.
+
+    On Python 3.12+ the coroutine starts synchronously inside this call, so work that
+    does not need to wait skips a trip through the event loop's ready queue. Older
+    versions fall back to ``asyncio.create_task``.
+
+    :param coro: Coroutine to run
+    """
+    if sys.version_info >= (3, 12):
+        return asyncio.Task(coro, loop=asyncio.get_running_loop(), eager_start=True)
+    return asyncio.create_task(coro)
@@ -51,10 +51,10 @@ class WebSocket:
                 await asyncio.sleep(0)
                 continue
             message = self._queue_in.get()
-            logger.debug(f"WebSocket message to send: {message}")
+            logger.debug("WebSocket message to send: %s", message)
             if self._ws:
                 await self._ws.send(message)
-                logger.debug(f"WebSocket message sent: {message}")
+                logger.debug("WebSocket message sent: %s", message)
                 self._queue_in.task_done()
             else:
                 logger.error("No WebSocket connection")
@@ -65,7 +65,7 @@ class WebSocket:
                 logger.error("No WebSocket connection")
                 return
             async for message in self._ws:
-                logger.debug(f"WebSocket received message: {message}".strip())
+                logger.debug("WebSocket received message: %s", message)
                 self._queue_out.put(message)
         except Exception as e:
             logger.error(f"WebSocket received error while receiving messages: {e}")
@@ -123,6 +123,26 @@ async def test_firebox_env_vars(sandbox):
     assert result.exit_code == 0
 
 
+@pytest.mark.asyncio
+async def test_firebox_persistent_shell(sandbox_config):
+    logger.info("Testing sandbox commands over a persistent shell")
+    s = Sandbox(template=sandbox_config.model_copy(update={"persistent_shell": True}))
+    while s.status != SandboxStatus.RUNNING:
+        await asyncio.sleep(0.1)
+    try:
+        docker_sandbox = s._docker_sandbox
+        assert await docker_sandbox.communicate("echo $TEST_ENV") == (0, "test_value")
+        assert await docker_sandbox.communicate("echo 'it'\\''s'; exit 3") == (
+            3,
+            "it's",
+        )
+        # Each command still runs on its own: cd and exit don't leak out
+        await docker_sandbox.communicate("cd /tmp")
+        assert await docker_sandbox.communicate("pwd") == (0, "/sandbox")
+    finally:
+        await s.close()
+
+
 @pytest.mark.asyncio
 async def test_firebox_timeout(sandbox):
     logger.info(f"Testing sandbox timeout with ID: {sandbox.id}")
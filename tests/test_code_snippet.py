@@ -0,0 +1,78 @@
+import pytest
+import asyncio
+from firebox.sandbox import Sandbox
+from firebox.models.sandbox import DockerSandboxConfig
+from firebox.models import SandboxStatus
+from firebox.config import config
+
+
+@pytest.fixture(scope="function")
+def sandbox_config(tmp_path):
+    persistent_storage_path = tmp_path / "persistent_storage"
+    persistent_storage_path.mkdir(exist_ok=True)
+    return DockerSandboxConfig(
+        image=config.sandbox_image,
+        cpu=config.cpu,
+        memory=config.memory,
+        persistent_storage_path=str(persistent_storage_path),
+        cwd="/sandbox",
+    )
+
+
+@pytest.fixture
+async def sandbox(sandbox_config):
+    sandbox = Sandbox(template=sandbox_config)
+
+    # Wait for the sandbox to be fully initialized
+    while sandbox.status != SandboxStatus.RUNNING:
+        await asyncio.sleep(0.1)
+
+    yield sandbox
+    await sandbox.close()
+
+
+@pytest.mark.asyncio
+async def test_add_script_keeps_content_verbatim(sandbox):
+    # Nothing in the content is expanded by a shell on the way in
+    content = "#!/bin/sh\necho \"$HOME\" '`date`' \\\\n\n"
+    await sandbox.code_snippet.add_script("verbatim.sh", content)
+
+    assert await sandbox.code_snippet.get_script_content("verbatim.sh") == content
+
+
+@pytest.mark.asyncio
+async def test_add_scripts(sandbox):
+    await sandbox.code_snippet.add_scripts(
+        [
+            ("first.sh", "#!/bin/sh\necho first\n"),
+            ("second.sh", "#!/bin/sh\necho second\n"),
+        ]
+    )
+
+    scripts = {
+        script.name: script.content
+        for script in await sandbox.code_snippet.list_scripts()
+    }
+    assert scripts["first.sh"] == "#!/bin/sh\necho first\n"
+    assert scripts["second.sh"] == "#!/bin/sh\necho second\n"
+
+    # Uploaded executable
+    result = await sandbox.process.start_and_wait("/root/commands/second.sh")
+    assert result.exit_code == 0
+    assert result.stdout == "second"
+
+
+@pytest.mark.asyncio
+async def test_list_scripts_keeps_content_verbatim(sandbox):
+    # NUL bytes and surrounding whitespace survive the listing
+    content = "\n  data\0more  \n\n"
+    await sandbox.code_snippet.add_scripts(
+        [("binary.sh", content), ("after.sh", "echo after")]
+    )
+
+    scripts = {
+        script.name: script.content
+        for script in await sandbox.code_snippet.list_scripts()
+    }
+    assert scripts["binary.sh"] == content
+    assert scripts["after.sh"] == "echo after"
@@ -4,7 +4,7 @@ import os
 from firebox.sandbox import Sandbox
 from firebox.models.sandbox import DockerSandboxConfig
 from firebox.models.filesystem import FilesystemOperation, FilesystemEvent
-from firebox.models import SandboxStatus
+from firebox.models import FileContentStatus, SandboxStatus
 from firebox.config import config
 from firebox.logs import logger
 
@@ -90,7 +90,7 @@ async def test_filesystem_get_size(filesystem):
     test_content = "Hello, World!"
     await filesystem.write("size_test.txt", test_content)
     size = await filesystem.get_size("size_test.txt")
-    expected_size = len(test_content.encode("utf-8")) + 1
+    expected_size = len(test_content.encode("utf-8"))
     assert size == expected_size, f"Expected size {expected_size}, but got {size}"
 
 
@@ -172,3 +172,151 @@ async def test_filesystem_upload_download(filesystem, tmp_path):
     ), "Downloaded content does not match original content"
 
     logger.info("Test completed successfully")
+
+
+@pytest.mark.asyncio
+async def test_filesystem_upload_download_file(filesystem, tmp_path):
+    test_content = bytes(range(256)) * 4
+    local_path = tmp_path / "local_upload.bin"
+    download_path = tmp_path / "downloaded.bin"
+    local_path.write_bytes(test_content)
+
+    await filesystem.upload_file(str(local_path), "uploaded.bin")
+    assert await filesystem.get_size("uploaded.bin") == len(test_content)
+
+    await filesystem.download_file("uploaded.bin", str(download_path))
+    assert download_path.read_bytes() == test_content
+
+    buffer = bytearray()
+    size = await filesystem.read_bytes_into("uploaded.bin", buffer)
+    assert size == len(test_content)
+    assert bytes(buffer[:size]) == test_content
+
+
+@pytest.mark.asyncio
+async def test_filesystem_upload_many_executables(filesystem, tmp_path):
+    # Larger than a single command line argument may be (128 KiB)
+    large_content = os.urandom(256 * 1024)
+    large_path = tmp_path / "large.bin"
+    large_path.write_bytes(large_content)
+    script_path = tmp_path / "script.sh"
+    script_path.write_bytes(b"#!/bin/sh\necho hello\n")
+
+    await filesystem.upload_many_executables(
+        [(str(large_path), "bin/large.bin"), (str(script_path), "bin/script.sh")]
+    )
+
+    assert await filesystem.read_bytes("bin/large.bin") == large_content
+    exit_code, output = await filesystem._sandbox.communicate("./bin/script.sh")
+    assert exit_code == 0
+    assert output == "hello"
+
+
+@pytest.mark.asyncio
+async def test_filesystem_list_with_contents(filesystem):
+    await filesystem.make_dir("listed/sub")
+    await filesystem.write("listed/small.txt", "small")
+    await filesystem.write("listed/empty.txt", "")
+    await filesystem.write_bytes("listed/large.bin", b"x" * 2048)
+
+    entries = {
+        entry.name: entry
+        for entry in await filesystem.list_with_contents("listed", inline_max=1024)
+    }
+
+    assert entries["small.txt"].status == FileContentStatus.Inlined
+    assert entries["small.txt"].content == b"small"
+    # Inlined but empty, unlike the skipped entries below
+    assert entries["empty.txt"].status == FileContentStatus.Inlined
+    assert entries["empty.txt"].content == b""
+    assert entries["large.bin"].status == FileContentStatus.Skipped
+    assert entries["large.bin"].content is None
+    assert entries["sub"].is_dir
+    assert entries["sub"].status == FileContentStatus.Skipped
+
+
+@pytest.mark.asyncio
+async def test_filesystem_read_bytes_stream(filesystem):
+    test_content = os.urandom(10 * 1024 + 5)
+    await filesystem.write_bytes("stream.bin", test_content)
+
+    chunks = [
+        chunk
+        async for chunk in filesystem.read_bytes_stream("stream.bin", chunk_size=4096)
+    ]
+
+    assert [len(chunk) for chunk in chunks] == [4096, 4096, 2053]
+    assert b"".join(chunks) == test_content
+
+
+@pytest.mark.asyncio
+async def test_filesystem_get_tree_size(filesystem):
+    await filesystem.make_dir("tree/nested")
+    await filesystem.write("tree/a.txt", "a" * 100)
+    await filesystem.write("tree/nested/b.txt", "b" * 200)
+
+    # get_size only stats the directory entry, get_tree_size walks it
+    tree_size = await filesystem.get_tree_size("tree")
+    assert tree_size >= 300
+    assert tree_size > await filesystem.get_size("tree")
+
+
+@pytest.mark.asyncio
+async def test_filesystem_watch_dir_async_listeners(filesystem):
+    sync_events = []
+    async_events = []
+
+    async def async_listener(event: FilesystemEvent):
+        await asyncio.sleep(0)
+        async_events.append(event)
+
+    async def failing_listener(event: FilesystemEvent):
+        raise RuntimeError("listener failure")
+
+    watcher = filesystem.watch_dir(".")
+    watcher.add_event_listener(sync_events.append)
+    watcher.add_event_listener(async_listener)
+    remove_failing = watcher.add_event_listener(failing_listener)
+    await watcher.start()
+
+    try:
+        await asyncio.sleep(1)  # Wait for watcher to start
+        await filesystem.write("async_listener.txt", "Hello")
+        await asyncio.sleep(2)  # Wait for events to be processed
+
+        remove_failing()
+        await filesystem.remove("async_listener.txt")
+        await asyncio.sleep(2)
+    finally:
+        await watcher.stop()
+
+    names = [
+        (event.name, event.operation)
+        for event in async_events
+        if event.name == "async_listener.txt"
+    ]
+    # A failing listener doesn't keep the others from getting the event
+    assert names == [
+        ("async_listener.txt", FilesystemOperation.Create),
+        ("async_listener.txt", FilesystemOperation.Remove),
+    ]
+    assert [
+        (event.name, event.operation)
+        for event in sync_events
+        if event.name == "async_listener.txt"
+    ] == names
+
+
+@pytest.mark.asyncio
+async def test_filesystem_upload_large_file(filesystem, tmp_path):
+    # Larger than a single command line argument may be (128 KiB)
+    test_content = os.urandom(300 * 1024)
+    local_path = tmp_path / "large_upload.bin"
+    local_path.write_bytes(test_content)
+
+    await filesystem.upload_file(str(local_path), "large/uploaded.bin")
+    assert await filesystem.get_size("large/uploaded.bin") == len(test_content)
+    assert await filesystem.read_bytes("large/uploaded.bin") == test_content
+
+    await filesystem.write_bytes("large/written.bin", test_content)
+    assert await filesystem.read_bytes("large/written.bin") == test_content
@@ -6,7 +6,7 @@ from firebox.models.process import ProcessMessage, ProcessOutput, RunningProcess
 from firebox.models import SandboxStatus
 from firebox.config import config
 from firebox.logs import logger
-from firebox.exception import TimeoutException
+from firebox.exception import ProcessException, TimeoutException
 
 
 @pytest.fixture(scope="function")
@@ -76,6 +76,7 @@ async def test_process_send_stdin(sandbox):
     process = await sandbox.process.start(
         "cat",
         on_stdout=lambda msg: logger.info(f"Received output: {msg.line}"),
+        stdin=True,
     )
     logger.info(f"Started process with ID: {process.process_id}")
 
@@ -91,6 +92,30 @@ async def test_process_send_stdin(sandbox):
     assert "AI Playground" in result.stdout
 
 
+@pytest.mark.asyncio
+async def test_process_close_stdin(sandbox):
+    process = await sandbox.process.start("cat", stdin=True)
+    await process.send_stdin("first\n")
+    await process.send_stdin("second\n")
+    await process.close_stdin()
+
+    # cat exits on its own once it reads EOF
+    result = await process.wait(timeout=5)
+    assert result.stdout.split("\n") == ["first", "second"]
+    assert result.exit_code == 0
+
+
+@pytest.mark.asyncio
+async def test_process_stdin_not_requested(sandbox):
+    # Without stdin=True the process reads EOF instead of waiting for input
+    process = await sandbox.process.start("cat")
+    result = await process.wait(timeout=5)
+    assert result.exit_code == 0
+
+    with pytest.raises(ProcessException):
+        await process.send_stdin("ignored\n")
+
+
 @pytest.mark.asyncio
 async def test_process_on_exit(sandbox):
     logger.info("Starting test_process_on_exit")
@@ -153,6 +178,27 @@ async def test_process_stream_output(sandbox):
     assert "Line 2" in output[1], f"Expected 'Line 2' in second output, got {output[1]}"
 
 
+@pytest.mark.asyncio
+async def test_process_stream_stderr(sandbox):
+    logger.info("Starting test_process_stream_stderr")
+    stdout, stderr = [], []
+
+    process = await sandbox.process.start(
+        "echo 'to stdout' && echo 'to stderr' >&2 && exit 3",
+        on_stdout=lambda message: stdout.append(message.line),
+        on_stderr=lambda message: stderr.append(message.line),
+    )
+
+    result = await process.wait(timeout=5)
+    logger.info(f"Process completed. Result: {result}")
+
+    assert stdout == ["to stdout"]
+    assert stderr == ["to stderr"]
+    assert result.stdout == "to stdout"
+    assert result.stderr == "to stderr"
+    assert result.exit_code == 3
+
+
 @pytest.mark.asyncio
 async def test_process_kill(sandbox):
     logger.info("Starting test_process_kill")
@@ -169,6 +215,36 @@ async def test_process_kill(sandbox):
     assert process.finished.done(), "Process should be finished after kill"
 
 
+@pytest.mark.asyncio
+async def test_process_kill_graceful(sandbox):
+    # Exits on its own on SIGTERM, so it is never sent SIGKILL
+    process = await sandbox.process.start(
+        "trap 'echo terminated; exit 0' TERM; sleep 30 & wait"
+    )
+    await asyncio.sleep(0.5)
+
+    await process.kill(graceful_timeout=5)
+
+    result = await process.wait(timeout=1)
+    assert "terminated" in result.stdout
+    assert result.exit_code == 0
+
+
+@pytest.mark.asyncio
+async def test_process_kill_escalates_to_sigkill(sandbox):
+    # Ignores SIGTERM, so kill has to follow up with SIGKILL
+    process = await sandbox.process.start("trap '' TERM; sleep 30")
+    await asyncio.sleep(0.5)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await process.kill(graceful_timeout=1)
+
+    assert process.finished.done(), "Process should be finished after kill"
+    assert loop.time() - started < 10
+    assert process.output.exit_code == 137
+
+
 @pytest.mark.asyncio
 async def test_process_timeout(sandbox):
     logger.info("Starting test_process_timeout")